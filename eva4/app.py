@@ -1,10 +1,59 @@
+import time
+
+_INICIO = time.perf_counter()
+
 import os
+import sys
 import datetime
+import threading
 import flet as ft
-from dotenv import load_dotenv
-from ecotech import Auth, Database, Finance
+# ecotech carga .env al importarse; oracledb, requests, numpy y bcrypt se importan al usarse
+from ecotech import INDICADORES, Auth, BcryptPool, Database, Finance, IndicatorStore, PrefetchScheduler, arranque, database_desde_env, metricas
+
+TAMANO_PAGINA_HISTORIAL = 50
+
+# Un único Database (con su pool de sesiones) compartido por todas las sesiones Flet.
+# Las sesiones y el precalentamiento pueden pedirlo a la vez, de ahí el lock.
+_db_compartida = None
+_lock_db = threading.Lock()
+
+
+def obtener_db() -> Database:
+    global _db_compartida
+    with _lock_db:
+        if _db_compartida is None:
+            _db_compartida = database_desde_env()
+            _db_compartida.migrate()
+            arranque.marcar("base de datos lista")
+    return _db_compartida
+
+
+# Finance compartido para que todas las sesiones aprovechen la misma caché
+_finanzas_compartida = None
+_lock_finanzas = threading.Lock()
+
+
+def obtener_finanzas() -> Finance:
+    global _finanzas_compartida
+    with _lock_finanzas:
+        if _finanzas_compartida is None:
+            _finanzas_compartida = Finance(store=IndicatorStore(
+                path=os.getenv("INDICADORES_STORE", "indicadores.sqlite3"),
+                max_rows=int(os.getenv("INDICADORES_STORE_MAX", "100000")),
+            ))
+            arranque.marcar("finanzas lista")
+    return _finanzas_compartida
+
+
+def precalentar():
+    # Conecta e importa en segundo plano mientras el usuario ve la primera pantalla;
+    # si falla, el error se mostrará en la primera operación que use la base
+    try:
+        obtener_db()
+        obtener_finanzas()
+    except Exception as ex:
+        print("No se pudo preparar la conexión:", ex)
 
-load_dotenv()
 
 class Aplicacion:
     def __init__(self, pagina: ft.Page):
@@ -14,15 +63,9 @@ class Aplicacion:
         self.pagina.window_height = 800
         self.pagina.theme_mode = ft.ThemeMode.LIGHT
 
-        # Inicializar base de datos y API
-        self.db = Database(
-            username=os.getenv("ORACLE_USER"),
-            password=os.getenv("ORACLE_PASSWORD"),
-            dsn=os.getenv("ORACLE_DSN")
-        )
-        self.db.create_all_tables()
-        self.finanzas = Finance()
+        # La base de datos y la API se obtienen al usarse (ver propiedades db y finanzas)
         self.usuario_logeado = None
+        self.token_sesion = None
 
         # DatePicker para elegir fechas
         self.date_picker = ft.DatePicker(
@@ -36,26 +79,103 @@ class Aplicacion:
         self._ultimo_resultado = None
         self._ultimo_indicador = None
 
-        # Inicia en registro
+        # Id de la operación en segundo plano vigente (cambia al cancelar o cambiar de pantalla)
+        self._operacion = 0
+
+        # Inicia en registro; la conexión se prepara después de pintar la pantalla
         self.pantalla_registro()
+        arranque.marcar("primera pantalla")
+        self.pagina.run_thread(precalentar)
+
+    @property
+    def db(self) -> Database:
+        return obtener_db()
+
+    @property
+    def finanzas(self) -> Finance:
+        return obtener_finanzas()
+
+    # -------------------------
+    # Operaciones en segundo plano
+    # -------------------------
+    def _limpiar_pantalla(self):
+        # Al cambiar de pantalla se descarta cualquier operación pendiente
+        self._operacion += 1
+        self.pagina.controls.clear()
+
+    def _barra_progreso(self) -> ft.Row:
+        self.progreso = ft.ProgressRing(width=16, height=16, stroke_width=2, visible=False)
+        self.texto_progreso = ft.Text(value="")
+        self.boton_cancelar = ft.TextButton("Cancelar", visible=False, on_click=lambda e: self._cancelar_operacion())
+        return ft.Row([self.progreso, self.texto_progreso, self.boton_cancelar])
+
+    def _mostrar_progreso(self, mensaje: str = "", cancelable: bool = True):
+        activo = bool(mensaje)
+        self.progreso.visible = activo
+        self.boton_cancelar.visible = activo and cancelable
+        self.texto_progreso.value = mensaje
+        self.texto_progreso.color = None
+
+    def _en_segundo_plano(self, mensaje: str, tarea, al_terminar, cancelable: bool = True):
+        """
+        Ejecuta tarea() (bcrypt, HTTP u Oracle) en un hilo aparte para no congelar la
+        ventana, y luego al_terminar(resultado). Si el usuario cancela, inicia otra
+        operación o cambia de pantalla, el resultado se descarta. Cancelar no detiene
+        tarea(), así que las escrituras usan cancelable=False y no muestran el botón.
+        """
+        self._operacion += 1
+        operacion = self._operacion
+        self._mostrar_progreso(mensaje, cancelable)
+        self.pagina.update()
+
+        def ejecutar():
+            try:
+                resultado = tarea()
+                error = None
+            except Exception as ex:
+                resultado, error = None, ex
+            if operacion != self._operacion:
+                return
+            self._mostrar_progreso()
+            if error is not None:
+                self.texto_progreso.value = f"Error: {error}"
+                self.texto_progreso.color = ft.Colors.RED_400
+            else:
+                al_terminar(resultado)
+            self.pagina.update()
+
+        self.pagina.run_thread(ejecutar)
+
+    def _cancelar_operacion(self):
+        self._operacion += 1
+        self._mostrar_progreso()
+        self.texto_progreso.value = "Operación cancelada"
+        self.pagina.update()
 
     # -------------------------
     # Pantalla de registro
     # -------------------------
     def pantalla_registro(self):
-        self.pagina.controls.clear()
+        self._limpiar_pantalla()
         self.input_usuario = ft.TextField(label="Usuario")
         self.input_contrasena = ft.TextField(label="Contraseña", password=True, can_reveal_password=True)
         self.boton_registrar = ft.ElevatedButton("Registrar", on_click=self.registrar)
         self.texto_estado = ft.Text(value="")
         self.boton_login = ft.ElevatedButton("Ya tengo cuenta", on_click=lambda e: self.pantalla_login())
-        self.pagina.add(self.input_usuario, self.input_contrasena, self.boton_registrar, self.texto_estado, self.boton_login)
+        self.pagina.add(self.input_usuario, self.input_contrasena, self.boton_registrar, self._barra_progreso(), self.texto_estado, self.boton_login)
         self.pagina.update()
 
     def registrar(self, e):
         usuario = (self.input_usuario.value or "").strip()
         contrasena = (self.input_contrasena.value or "").strip()
-        estado = Auth.register(self.db, usuario, contrasena)
+        self._en_segundo_plano(
+            "Registrando...",
+            lambda: Auth.register(self.db, usuario, contrasena),
+            self._registro_terminado,
+            cancelable=False,
+        )
+
+    def _registro_terminado(self, estado: dict):
         self.texto_estado.value = estado["message"]
         self.texto_estado.color = ft.Colors.GREEN_600 if estado["success"] else ft.Colors.RED_400
         self.pagina.update()
@@ -66,51 +186,69 @@ class Aplicacion:
     # Pantalla de login
     # -------------------------
     def pantalla_login(self):
-        self.pagina.controls.clear()
+        self._limpiar_pantalla()
         self.input_usuario = ft.TextField(label="Usuario")
         self.input_contrasena = ft.TextField(label="Contraseña", password=True, can_reveal_password=True)
         self.boton_login = ft.Button("Iniciar sesión", on_click=self.login)
         self.texto_estado = ft.Text(value="")
-        self.pagina.add(self.input_usuario, self.input_contrasena, self.boton_login, self.texto_estado)
+        self.pagina.add(self.input_usuario, self.input_contrasena, self.boton_login, self._barra_progreso(), self.texto_estado)
         self.pagina.update()
 
     def login(self, e):
         usuario = (self.input_usuario.value or "").strip()
         contrasena = (self.input_contrasena.value or "").strip()
-        estado = Auth.login(self.db, usuario, contrasena)
+        self._en_segundo_plano(
+            "Verificando credenciales...",
+            lambda: Auth.login(self.db, usuario, contrasena, cliente=self.pagina.client_ip),
+            lambda estado: self._login_terminado(usuario, estado),
+        )
+
+    def _login_terminado(self, usuario: str, estado: dict):
         self.texto_estado.value = estado["message"]
         self.texto_estado.color = ft.Colors.GREEN_600 if estado["success"] else ft.Colors.RED_400
         self.pagina.update()
         if estado["success"]:
             self.usuario_logeado = usuario
+            self.token_sesion = estado["token"]
             self.pantalla_menu()
 
+    def _sesion_valida(self) -> bool:
+        # Validar el token es un lookup en memoria: no repite Oracle ni bcrypt
+        if self.token_sesion and Auth.sesiones.validate(self.token_sesion) == self.usuario_logeado:
+            return True
+        self.cerrar_sesion()
+        return False
+
+    def cerrar_sesion(self):
+        if self.token_sesion:
+            Auth.sesiones.revoke(self.token_sesion)
+        self.token_sesion = None
+        self.usuario_logeado = None
+        self.pantalla_login()
+
     # -------------------------
     # Pantalla principal
     # -------------------------
     def pantalla_menu(self):
-        self.pagina.controls.clear()
+        if not self._sesion_valida():
+            return
+        self._limpiar_pantalla()
         self.pagina.add(ft.Text(f"Bienvenido {self.usuario_logeado}", size=20))
         self.pagina.add(ft.Button(content="Consultar indicador", on_click=lambda e: self.pantalla_indicador()))
         self.pagina.add(ft.Button(content="Historial", on_click=lambda e: self.pantalla_historial()))
-        self.pagina.add(ft.Button(content="Cerrar sesión", on_click=lambda e: self.pantalla_login()))
+        self.pagina.add(ft.Button(content="Cerrar sesión", on_click=lambda e: self.cerrar_sesion()))
         self.pagina.update()
 
     # -------------------------
     # Pantalla de consulta de indicador
     # -------------------------
     def pantalla_indicador(self):
-        self.pagina.controls.clear()
+        if not self._sesion_valida():
+            return
+        self._limpiar_pantalla()
         self.dropdown_indicador = ft.Dropdown(
             label="Indicador",
-            options=[
-                ft.dropdown.Option("uf"),
-                ft.dropdown.Option("dolar"),
-                ft.dropdown.Option("euro"),
-                ft.dropdown.Option("utm"),
-                ft.dropdown.Option("ipc"),
-                ft.dropdown.Option("ivp"),
-            ],
+            options=[ft.dropdown.Option(indicador) for indicador in INDICADORES],
             width=300
         )
         self.input_fecha = ft.TextField(label="Fecha", read_only=True, width=200)
@@ -120,7 +258,7 @@ class Aplicacion:
         self.boton_guardar = ft.Button(content="Guardar consulta", on_click=self.guardar_indicador, disabled=True)
         self.texto_estado_indicador = ft.Text(value="", color=ft.Colors.RED_400)
         self.texto_resultado = ft.Text(value="", selectable=True)
-        self.pagina.add(self.dropdown_indicador, ft.Row([self.input_fecha, self.boton_fecha]), ft.Row([self.boton_consultar, self.boton_guardar]), self.texto_estado_indicador, self.texto_resultado, ft.Button(content="Volver", on_click=lambda e: self.pantalla_menu()))
+        self.pagina.add(self.dropdown_indicador, ft.Row([self.input_fecha, self.boton_fecha]), ft.Row([self.boton_consultar, self.boton_guardar]), self._barra_progreso(), self.texto_estado_indicador, self.texto_resultado, ft.Button(content="Volver", on_click=lambda e: self.pantalla_menu()))
         self.pagina.update()
 
     def _on_fecha_seleccionada(self, e):
@@ -142,9 +280,15 @@ class Aplicacion:
             self.pagina.update()
             return
 
-    # Llamada al método interno (privado) que ya estás usando
-        datos_raw = self.finanzas._fetch_indicator(indicador, fecha)
+    # Llamada al método interno (privado) que ya estás usando, fuera del hilo de eventos
+        self.boton_guardar.disabled = True
+        self._en_segundo_plano(
+            f"Consultando {indicador.upper()}...",
+            lambda: self.finanzas._fetch_indicator(indicador, fecha),
+            lambda datos_raw: self._mostrar_indicador(indicador, fecha, datos_raw),
+        )
 
+    def _mostrar_indicador(self, indicador: str, fecha: str, datos_raw):
         if not datos_raw:
         # No hay datos o error al consultar
             self.texto_estado_indicador.value = "No hay datos para la fecha seleccionada o error al consultar."
@@ -168,21 +312,28 @@ class Aplicacion:
             self.texto_resultado.value = f"{indicador.upper()} {fecha}: {datos['valor']} (Fuente: {datos['fuente']})"
             self.boton_guardar.disabled = False
 
-        self.pagina.update()
-
 
     def guardar_indicador(self, e):
-        if self._ultimo_resultado:
-            self.finanzas.guardar_consulta(self.db, self.usuario_logeado, self._ultimo_indicador, self._ultimo_resultado)
-            self.texto_estado_indicador.value = "Consulta guardada"
-            self.texto_estado_indicador.color = ft.Colors.GREEN_600
-            self.pagina.update()
+        if self._ultimo_resultado and self._sesion_valida():
+            usuario, indicador, datos = self.usuario_logeado, self._ultimo_indicador, self._ultimo_resultado
+            self._en_segundo_plano(
+                "Guardando...",
+                lambda: self.finanzas.guardar_consulta(self.db, usuario, indicador, datos),
+                self._guardado_terminado,
+                cancelable=False,
+            )
+
+    def _guardado_terminado(self, estado: dict):
+        self.texto_estado_indicador.value = estado["message"]
+        self.texto_estado_indicador.color = ft.Colors.GREEN_600 if estado["success"] else ft.Colors.RED_400
 
     # -------------------------
     # Pantalla de historial
     # -------------------------
     def pantalla_historial(self):
-        self.pagina.controls.clear()
+        if not self._sesion_valida():
+            return
+        self._limpiar_pantalla()
         self.tabla = ft.DataTable(
             columns=[
                 ft.DataColumn(ft.Text("Indicador")),
@@ -193,24 +344,64 @@ class Aplicacion:
             ],
             rows=[]
         )
-        self.recargar_historial()
-        self.pagina.add(ft.Text("Historial de consultas", size=20, weight=ft.FontWeight.BOLD), self.tabla, ft.Button(content="Volver", on_click=lambda e: self.pantalla_menu()))
+        self.boton_mas_historial = ft.Button(content="Cargar más", on_click=lambda e: self.cargar_pagina_historial(), visible=False)
+        self.pagina.add(ft.Text("Historial de consultas", size=20, weight=ft.FontWeight.BOLD), self._barra_progreso(), self.tabla, self.boton_mas_historial, ft.Button(content="Volver", on_click=lambda e: self.pantalla_menu()))
         self.pagina.update()
+        self.recargar_historial()
 
     def recargar_historial(self):
-        filas = self.db.query("SELECT indicador, fecha_indicador, valor, fecha_consulta, fuente FROM historial_consultas WHERE usuario=:usr", {"usr": self.usuario_logeado}) or []
-        self.tabla.rows = [
+        self.tabla.rows = []
+        self._cursor_historial = None
+        self.cargar_pagina_historial()
+
+    def cargar_pagina_historial(self):
+        # Carga la siguiente página (keyset) y la agrega al final de la tabla
+        usuario, cursor = self.usuario_logeado, self._cursor_historial
+        self._en_segundo_plano(
+            "Cargando historial...",
+            lambda: self.db.fetch_history(usuario, after_cursor=cursor, page_size=TAMANO_PAGINA_HISTORIAL),
+            self._mostrar_historial,
+        )
+
+    def _mostrar_historial(self, pagina: dict):
+        self._cursor_historial = pagina["next_cursor"]
+        self.boton_mas_historial.visible = pagina["next_cursor"] is not None
+        self.tabla.rows += [
             ft.DataRow(cells=[
                 ft.DataCell(ft.Text(str(f[0]))),
                 ft.DataCell(ft.Text(str(f[1]))),
                 ft.DataCell(ft.Text(str(f[2]))),
                 ft.DataCell(ft.Text(str(f[3]))),
                 ft.DataCell(ft.Text(str(f[4]))),
-            ]) for f in filas
+            ]) for f in pagina["rows"]
         ]
 
 def main(pagina: ft.Page):
     Aplicacion(pagina)
 
+def iniciar_prefetch():
+    # Mantiene caliente el valor del día de cada indicador
+    PrefetchScheduler(
+        obtener_finanzas(),
+        horas=os.getenv("PREFETCH_HORAS", "09:05,18:05").split(","),
+        estado=os.getenv("PREFETCH_ESTADO", "prefetch_estado.json"),
+    ).start()
+
+
 if __name__ == "__main__":
+    # --tiempos (o ECOTECH_TIEMPOS) imprime las marcas de arranque hasta la primera pantalla
+    arranque.inicio = _INICIO
+    arranque.marcar("imports")
+    if "--tiempos" in sys.argv or os.getenv("ECOTECH_TIEMPOS"):
+        arranque.activar()
+    if os.getenv("METRICAS_PUERTO"):
+        metricas.servir(int(os.getenv("METRICAS_PUERTO")))
+    # Pool de procesos bcrypt compartido por todas las sesiones
+    Auth.hasher = BcryptPool(
+        rounds=int(os.getenv("BCRYPT_ROUNDS", "12")),
+        workers=int(os.getenv("BCRYPT_WORKERS", "0")) or None,
+        max_pendientes=int(os.getenv("BCRYPT_MAX_PENDIENTES", "64")),
+    )
+    # Finance importa requests al crearse: no debe retrasar la primera pantalla
+    threading.Thread(target=iniciar_prefetch, daemon=True).start()
     ft.app(target=main)
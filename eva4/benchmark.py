@@ -0,0 +1,402 @@
+"""
+Benchmarks reproducibles de Finance, Auth y el guardado de historial sin depender de
+mindicador.cl ni de Oracle: levanta un servidor HTTP local que imita la API (con
+latencia y tasa de errores configurables) y usa una base de datos en memoria. El
+escenario "sqlite" pasa por Database real con SQLiteBackend en un archivo temporal.
+
+Uso:
+    python benchmark.py                          # todos los escenarios
+    python benchmark.py -e lookup -e login_storm -n 500
+    python benchmark.py --salida hoy.json --comparar ayer.json
+
+Cada escenario informa operaciones por segundo, latencias p50/p95/p99 (ms), errores
+y el pico de memoria asignada. La memoria se mide con tracemalloc en una segunda
+pasada aparte, para que su costo no infle las latencias. Con --salida se guarda un JSON con el
+commit actual para comparar corridas entre commits con --comparar.
+"""
+import argparse
+import datetime
+import json
+import platform
+import random
+import statistics
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional
+
+from ecotech import INDICADORES, Auth, Database, Finance, PasswordHasher, SQLiteBackend, TokenBucketLimiter
+
+BASES = {"uf": 36000.0, "dolar": 900.0, "euro": 1000.0, "utm": 65000.0, "ipc": 0.4, "ivp": 38000.0}
+
+
+# ------------------------------
+# mindicador.cl local
+# ------------------------------
+class FakeIndicadores:
+    """Servidor HTTP local con las rutas /api/{indicador}/{dd-mm-yyyy} y /api/{indicador}/{yyyy}."""
+
+    def __init__(self, latencia: float = 0.0, tasa_errores: float = 0.0, seed: int = 1234):
+        self.latencia = latencia
+        self.tasa_errores = tasa_errores
+        self.solicitudes = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        servidor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                servidor._atender(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self._hilo = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}/api"
+
+    @staticmethod
+    def _valor(indicador: str, fecha: datetime.date) -> float:
+        return round(BASES[indicador] * (1 + (fecha.toordinal() % 97) / 1000), 2)
+
+    def _punto(self, indicador: str, fecha: datetime.date) -> dict:
+        return {"fecha": f"{fecha.isoformat()}T03:00:00.000Z", "valor": self._valor(indicador, fecha)}
+
+    def _atender(self, handler: BaseHTTPRequestHandler):
+        with self._lock:
+            self.solicitudes += 1
+            falla = self._rng.random() < self.tasa_errores
+        if self.latencia:
+            time.sleep(self.latencia)
+        partes = handler.path.strip("/").split("/")
+        if falla or len(partes) != 3 or partes[1] not in BASES:
+            handler.send_response(500 if falla else 404)
+            handler.end_headers()
+            return
+        indicador, periodo = partes[1], partes[2]
+        if len(periodo) == 4:
+            inicio = datetime.date(int(periodo), 1, 1)
+            dias = (datetime.date(int(periodo) + 1, 1, 1) - inicio).days
+            serie = [
+                self._punto(indicador, inicio + datetime.timedelta(days=d))
+                for d in range(dias - 1, -1, -1)
+                if (inicio + datetime.timedelta(days=d)).weekday() < 5
+            ]
+        else:
+            fecha = datetime.datetime.strptime(periodo, "%d-%m-%Y").date()
+            serie = [self._punto(indicador, fecha)]
+        cuerpo = json.dumps({"codigo": indicador, "serie": serie}).encode("UTF-8")
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(cuerpo)))
+        handler.end_headers()
+        handler.wfile.write(cuerpo)
+
+    def __enter__(self):
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+# ------------------------------
+# Base de datos en memoria
+# ------------------------------
+class FakeDatabase:
+    """
+    Sustituto en proceso de Database para las sentencias con nombre que usan Auth y
+    Finance. `latencia` simula el viaje de ida y vuelta a Oracle en cada llamada.
+    """
+
+    def __init__(self, latencia: float = 0.0):
+        self.latencia = latencia
+        self.viajes = 0
+        self.usuarios = {}
+        self.historial: List[dict] = []
+        self.indicator_log: List[dict] = []
+        self._lock = threading.Lock()
+
+    def _viaje(self):
+        with self._lock:
+            self.viajes += 1
+        if self.latencia:
+            time.sleep(self.latencia)
+
+    def fetch(self, sentencia: str, parameters: Optional[dict] = None) -> Optional[list]:
+        self._viaje()
+        if sentencia == "usuario_por_nombre":
+            fila = self.usuarios.get(parameters["username"])
+            return [fila] if fila else []
+        return []
+
+    def execute(self, sentencia: str, parameters: Optional[dict] = None) -> Optional[int]:
+        self._viaje()
+        with self._lock:
+            if sentencia == "insertar_usuario":
+                self.usuarios[parameters["username"]] = (len(self.usuarios) + 1, parameters["username"], parameters["password"])
+            elif sentencia == "actualizar_password":
+                for nombre, (user_id, _, _) in self.usuarios.items():
+                    if user_id == parameters["id"]:
+                        self.usuarios[nombre] = (user_id, nombre, parameters["password"])
+            elif sentencia == "insertar_historial":
+                self.historial.append(dict(parameters))
+            elif sentencia == "insertar_indicator_log":
+                self.indicator_log.append(dict(parameters))
+        return 1
+
+    def query_many(self, sentencia: str, filas: List[dict]) -> Optional[int]:
+        self._viaje()
+        with self._lock:
+            destino = self.historial if sentencia == "insertar_historial" else self.indicator_log
+            destino.extend(dict(f) for f in filas)
+        return len(filas)
+
+    def query(self, sql: str, parameters: Optional[dict] = None):
+        if sql.strip().upper().startswith("SELECT"):
+            return self.fetch(sql, parameters)
+        self.execute(sql, parameters)
+
+    def close(self):
+        pass
+
+
+# ------------------------------
+# Medición
+# ------------------------------
+def medir(
+    nombre: str,
+    operacion: Callable[[int], object],
+    n: int,
+    hilos: int = 1,
+    preparar: Optional[Callable[[], object]] = None,
+) -> dict:
+    """
+    Ejecuta operacion(i) para i en range(n) con `hilos` hilos y resume las latencias.
+    Luego repite las operaciones con tracemalloc activo solo para medir el pico de
+    memoria; `preparar()` devuelve el estado inicial (p. ej. vacía la caché) antes de
+    esa segunda pasada, para que mida lo mismo que la primera.
+    """
+    latencias: List[float] = []
+    errores = 0
+
+    def cronometrar(i: int):
+        inicio = time.perf_counter()
+        try:
+            ok = operacion(i) is not None
+        except Exception:
+            ok = False
+        return time.perf_counter() - inicio, ok
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+        for latencia, ok in ejecutor.map(cronometrar, range(n)):
+            latencias.append(latencia)
+            errores += not ok
+    total = time.perf_counter() - inicio
+
+    if preparar is not None:
+        preparar()
+    tracemalloc.start()
+    with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+        list(ejecutor.map(cronometrar, range(n)))
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    cortes = statistics.quantiles(latencias, n=100) if len(latencias) > 1 else latencias * 99
+    return {
+        "escenario": nombre,
+        "n": n,
+        "hilos": hilos,
+        "ops_s": round(n / total, 1),
+        "p50_ms": round(cortes[49] * 1000, 3),
+        "p95_ms": round(cortes[94] * 1000, 3),
+        "p99_ms": round(cortes[98] * 1000, 3),
+        "errores": errores,
+        "pico_kb": round(pico / 1024, 1),
+    }
+
+
+def fechas_pasadas(n: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    hoy = datetime.date.today()
+    return [(hoy - datetime.timedelta(days=rng.randint(1, 3650))).strftime("%d-%m-%Y") for _ in range(n)]
+
+
+# ------------------------------
+# Escenarios
+# ------------------------------
+def escenario_lookup(args, servidor: FakeIndicadores) -> List[dict]:
+    finanzas = Finance(base_url=servidor.base_url, backoff=0.01)
+    pares = [(INDICADORES[i % len(INDICADORES)], f) for i, f in enumerate(fechas_pasadas(args.n, args.seed))]
+    consultar = lambda i: finanzas._fetch_indicator(*pares[i])
+    resultados = [medir("lookup_frio", consultar, args.n, args.hilos, preparar=finanzas.cache.clear)]
+    resultados.append(medir("lookup_caliente", consultar, args.n, args.hilos))
+    finanzas.close()
+    return resultados
+
+
+def escenario_backfill(args, servidor: FakeIndicadores) -> List[dict]:
+    fin = datetime.date.today() - datetime.timedelta(days=1)
+    inicio = fin.replace(year=fin.year - 5)
+
+    def backfill(i: int):
+        finanzas = Finance(base_url=servidor.base_url, backoff=0.01)
+        try:
+            return finanzas.fetch_range(INDICADORES[i % len(INDICADORES)], inicio, fin)
+        finally:
+            finanzas.close()
+
+    return [medir("backfill_5_anios", backfill, max(1, args.n // 50), 1)]
+
+
+def escenario_login(args, servidor: FakeIndicadores) -> List[dict]:
+    db = FakeDatabase(latencia=args.latencia_db)
+    originales = (Auth.hasher, Auth.limitador_usuario, Auth.limitador_cliente)
+    # Sin límite de intentos: se mide el costo de la verificación, no el limitador
+    Auth.hasher = PasswordHasher(rounds=args.bcrypt_rounds)
+    Auth.limitador_usuario = TokenBucketLimiter(capacidad=float("inf"))
+    Auth.limitador_cliente = TokenBucketLimiter(capacidad=float("inf"))
+    try:
+        usuarios = [f"bench_{i}" for i in range(min(args.n, 20))]
+        for usuario in usuarios:
+            Auth.register(db, usuario, "clave12345")
+        login = lambda i: Auth.login(db, usuarios[i % len(usuarios)], "clave12345")["success"] or None
+        return [medir("login_storm", login, args.n, args.hilos)]
+    finally:
+        Auth.hasher, Auth.limitador_usuario, Auth.limitador_cliente = originales
+
+
+def escenario_historial(args, servidor: FakeIndicadores) -> List[dict]:
+    finanzas = Finance(base_url=servidor.base_url)
+    datos = {"valor": 36000.0, "fuente": servidor.base_url, "fecha_indicador": datetime.date.today()}
+
+    db = FakeDatabase(latencia=args.latencia_db)
+    uno = lambda i: finanzas.guardar_consulta(db, "bench", "uf", datos)["success"] or None
+    resultados = [medir("historial_fila_a_fila", uno, args.n, args.hilos)]
+
+    db = FakeDatabase(latencia=args.latencia_db)
+    lote = 100
+    lotes = lambda i: finanzas.guardar_consultas(db, [("bench", "uf", datos)] * lote)["success"] or None
+    resultado = medir("historial_lotes_100", lotes, max(1, args.n // lote), 1)
+    resultado["filas_s"] = round(resultado["ops_s"] * lote, 1)
+    resultados.append(resultado)
+    finanzas.close()
+    return resultados
+
+
+def escenario_sqlite(args, servidor: FakeIndicadores) -> List[dict]:
+    """Login, historial e historial paginado a través de Database (pool, caché de sentencias, executemany)."""
+    directorio = tempfile.mkdtemp(prefix="ecotech_bench_")
+    db = Database(backend=SQLiteBackend(f"{directorio}/bench.sqlite3"))
+    finanzas = Finance(base_url=servidor.base_url)
+    originales = (Auth.hasher, Auth.limitador_usuario, Auth.limitador_cliente)
+    Auth.hasher = PasswordHasher(rounds=args.bcrypt_rounds)
+    Auth.limitador_usuario = TokenBucketLimiter(capacidad=float("inf"))
+    Auth.limitador_cliente = TokenBucketLimiter(capacidad=float("inf"))
+    try:
+        db.migrate()
+        resultados = []
+        usuarios = [f"bench_{i}" for i in range(min(args.n, 20))]
+        for usuario in usuarios:
+            Auth.register(db, usuario, "clave12345")
+        login = lambda i: Auth.login(db, usuarios[i % len(usuarios)], "clave12345")["success"] or None
+        resultados.append(medir("sqlite_login", login, args.n, args.hilos))
+
+        datos = {"valor": 36000.0, "fuente": servidor.base_url, "fecha_indicador": datetime.date.today()}
+        uno = lambda i: finanzas.guardar_consulta(db, "bench", "uf", datos)["success"] or None
+        resultados.append(medir("sqlite_historial_fila", uno, args.n, args.hilos))
+
+        lote = 100
+        lotes = lambda i: finanzas.guardar_consultas(db, [("bench", "uf", datos)] * lote)["success"] or None
+        resultado = medir("sqlite_lotes_100", lotes, max(1, args.n // lote), 1)
+        resultado["filas_s"] = round(resultado["ops_s"] * lote, 1)
+        resultados.append(resultado)
+
+        pagina = lambda i: db.fetch_history("bench", page_size=50)
+        resultados.append(medir("sqlite_pagina", pagina, args.n, args.hilos))
+        return resultados
+    finally:
+        Auth.hasher, Auth.limitador_usuario, Auth.limitador_cliente = originales
+        finanzas.close()
+        db.close()
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+ESCENARIOS = {
+    "lookup": escenario_lookup,
+    "backfill": escenario_backfill,
+    "login_storm": escenario_login,
+    "historial": escenario_historial,
+    "sqlite": escenario_sqlite,
+}
+
+
+# ------------------------------
+# Reporte
+# ------------------------------
+def commit_actual() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def imprimir(resultados: List[dict], anteriores: Optional[dict] = None):
+    print(f"{'escenario':<24}{'n':>7}{'ops/s':>11}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'err':>6}{'pico KB':>10}")
+    for r in resultados:
+        linea = f"{r['escenario']:<24}{r['n']:>7}{r['ops_s']:>11}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['errores']:>6}{r['pico_kb']:>10}"
+        previo = (anteriores or {}).get(r["escenario"])
+        if previo:
+            linea += f"   ops/s {(r['ops_s'] / previo['ops_s'] - 1) * 100:+.1f}%  p50 {(r['p50_ms'] / previo['p50_ms'] - 1) * 100 if previo['p50_ms'] else 0:+.1f}%"
+        print(linea)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de Finance, Auth e historial con servicios locales.")
+    parser.add_argument("-e", "--escenario", action="append", choices=sorted(ESCENARIOS), help="repetible; por defecto todos")
+    parser.add_argument("-n", type=int, default=200, help="operaciones por escenario")
+    parser.add_argument("--hilos", type=int, default=4)
+    parser.add_argument("--latencia-http", type=float, default=0.02, help="segundos por solicitud al servidor falso")
+    parser.add_argument("--errores-http", type=float, default=0.0, help="fracción de solicitudes que responden 500")
+    parser.add_argument("--latencia-db", type=float, default=0.002, help="segundos por viaje a la base en memoria")
+    parser.add_argument("--bcrypt-rounds", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--salida", help="guardar resultados en este JSON")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para mostrar diferencias")
+    args = parser.parse_args()
+
+    resultados: List[dict] = []
+    with FakeIndicadores(latencia=args.latencia_http, tasa_errores=args.errores_http, seed=args.seed) as servidor:
+        for nombre in args.escenario or list(ESCENARIOS):
+            resultados.extend(ESCENARIOS[nombre](args, servidor))
+
+    anteriores = None
+    if args.comparar:
+        with open(args.comparar, encoding="UTF-8") as archivo:
+            anteriores = {r["escenario"]: r for r in json.load(archivo)["resultados"]}
+    imprimir(resultados, anteriores)
+
+    if args.salida:
+        with open(args.salida, "w", encoding="UTF-8") as archivo:
+            json.dump({
+                "commit": commit_actual(),
+                "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "parametros": vars(args),
+                "resultados": resultados,
+            }, archivo, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,117 @@
-import oracledb
-import requests
+from __future__ import annotations
+
 import os
-from dotenv import load_dotenv
-import bcrypt
-from typing import Optional, Tuple
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Tuple, Union
+import base64
+import bisect
+import contextlib
 import datetime
+import hashlib
+import hmac
+import importlib
+import json
+import random
 import re
+import secrets
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+import concurrent.futures
+from concurrent.futures import Future
+
+if TYPE_CHECKING:
+    # Solo para anotaciones: http.server se importa recién en Metrics.servir()
+    from http.server import ThreadingHTTPServer
+
+
+class Arranque:
+    """
+    Marcas de tiempo del arranque (segundos desde `inicio`). Los puntos de entrada
+    ajustan `inicio` al comienzo del proceso y llaman a activar() con --tiempos o
+    ECOTECH_TIEMPOS para imprimir cada marca a medida que ocurre.
+    """
+
+    def __init__(self, inicio: Optional[float] = None):
+        self.inicio = inicio if inicio is not None else time.perf_counter()
+        self.activo = False
+        self.etapas = []
+        self._lock = threading.Lock()
+
+    def marcar(self, etapa: str, duracion: Optional[float] = None):
+        marca = (etapa, time.perf_counter(), duracion)
+        with self._lock:
+            self.etapas.append(marca)
+        if self.activo:
+            print(self._linea(marca))
+
+    def _linea(self, marca) -> str:
+        etapa, instante, duracion = marca
+        extra = f" ({duracion * 1000:.1f} ms)" if duracion is not None else ""
+        return f"[arranque] {(instante - self.inicio) * 1000:8.1f} ms  {etapa}{extra}"
+
+    def activar(self):
+        # Muestra también las marcas anteriores (p. ej. las de la importación)
+        self.activo = True
+        print(self.reporte())
+
+    def reporte(self) -> str:
+        with self._lock:
+            return "\n".join(self._linea(m) for m in self.etapas)
+
+
+arranque = Arranque()
+
+
+class _ModuloPerezoso:
+    """
+    Importa el módulo real en el primer acceso a uno de sus atributos. oracledb,
+    requests, numpy, bcrypt y asyncio suman cientos de ms de importación y no hacen falta para
+    mostrar la primera pantalla; así se cargan recién al conectar, consultar o hashear.
+    """
+
+    def __init__(self, nombre: str):
+        self._nombre = nombre
+        self._modulo = None
 
-load_dotenv()
+    def __getattr__(self, atributo: str):
+        if self._modulo is None:
+            inicio = time.perf_counter()
+            modulo = importlib.import_module(self._nombre)
+            if self._modulo is None:
+                self._modulo = modulo
+                arranque.marcar(f"import {self._nombre}", time.perf_counter() - inicio)
+        return getattr(self._modulo, atributo)
+
+
+oracledb = _ModuloPerezoso("oracledb")
+requests = _ModuloPerezoso("requests")
+np = _ModuloPerezoso("numpy")
+bcrypt = _ModuloPerezoso("bcrypt")
+# asyncio solo lo usan AsyncFinance y los métodos *_async de BcryptPool
+asyncio = _ModuloPerezoso("asyncio")
+
+
+def cargar_entorno():
+    # Auth.sesiones lee SESSION_SECRET al definirse la clase, así que .env se carga aquí
+    inicio = time.perf_counter()
+    from dotenv import load_dotenv
+    load_dotenv()
+    arranque.marcar("cargar .env", time.perf_counter() - inicio)
+
+
+cargar_entorno()
 
 username = os.getenv("ORACLE_USER")
 dsn = os.getenv("ORACLE_DSN")
 password = os.getenv("ORACLE_PASSWORD")
 
 
+# Indicadores que ofrece la aplicación (mismo conjunto que Validator.validate_indicator en oracle/gg.py)
+INDICADORES = ("uf", "dolar", "euro", "utm", "ipc", "ivp")
+
+
 def validar_username(u: str) -> bool:
    
     return bool(re.fullmatch(r"[A-Za-z0-9_.-]{3,32}", u))
@@ -32,18 +130,114 @@ def hoy_dd_mm_yyyy() -> str:
     return f"{now.day}-{now.month}-{now.year}"
 
 
-class Database:
-    def __init__(self, username: str, password: str, dsn: str):
-        self.username = username
-        self.dsn = dsn
-        self.password = password
+class Metrics:
+    """
+    Métricas en proceso: histogramas de duración por operación (http_fetch, json_parse,
+    bcrypt, db_acquire, db_execute, db_commit, ...) y contadores (errores, reintentos,
+    aciertos de caché). exportar() devuelve el formato de texto de Prometheus y
+    servir(puerto) lo publica en http://host:puerto/metrics.
+    """
 
-    def get_connection(self):
-        return oracledb.connect(user=self.username, password=self.password, dsn=self.dsn)
-   
-    def create_all_tables(self):
-        tables = [
-           
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, prefijo: str = "ecotech"):
+        self.prefijo = prefijo
+        self._histogramas = {}
+        self._contadores = {}
+        self._lock = threading.Lock()
+
+    def observar(self, operacion: str, segundos: float):
+        indice = bisect.bisect_left(self.BUCKETS, segundos)
+        with self._lock:
+            conteos, total = self._histogramas.get(operacion, ([0] * (len(self.BUCKETS) + 1), 0.0))
+            conteos[indice] += 1
+            self._histogramas[operacion] = (conteos, total + segundos)
+
+    @contextlib.contextmanager
+    def medir(self, operacion: str):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(operacion, time.perf_counter() - inicio)
+
+    def contar(self, nombre: str, cantidad: int = 1, **etiquetas: str):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + cantidad
+
+    @staticmethod
+    def _etiquetas(pares) -> str:
+        if not pares:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pares) + "}"
+
+    def exportar(self) -> str:
+        with self._lock:
+            histogramas = {k: (list(c), t) for k, (c, t) in self._histogramas.items()}
+            contadores = dict(self._contadores)
+        lineas = []
+        familia = f"{self.prefijo}_operacion_segundos"
+        if histogramas:
+            lineas.append(f"# TYPE {familia} histogram")
+        for operacion, (conteos, total) in sorted(histogramas.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.BUCKETS + ("+Inf",), conteos):
+                acumulado += conteo
+                lineas.append(f"{familia}_bucket{self._etiquetas([('operacion', operacion), ('le', limite)])} {acumulado}")
+            lineas.append(f"{familia}_sum{self._etiquetas([('operacion', operacion)])} {total}")
+            lineas.append(f"{familia}_count{self._etiquetas([('operacion', operacion)])} {acumulado}")
+        vistos = set()
+        for (nombre, pares), valor in sorted(contadores.items()):
+            if nombre not in vistos:
+                lineas.append(f"# TYPE {self.prefijo}_{nombre} counter")
+                vistos.add(nombre)
+            lineas.append(f"{self.prefijo}_{nombre}{self._etiquetas(pares)} {valor}")
+        return "\n".join(lineas) + "\n"
+
+    def servir(self, puerto: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metricas = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                cuerpo = metricas.exportar().encode("UTF-8")
+                self.send_response(200 if self.path.startswith("/metrics") else 404)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def log_message(self, *args):
+                pass
+
+        servidor = ThreadingHTTPServer((host, puerto), Handler)
+        threading.Thread(target=servidor.serve_forever, name="metricas", daemon=True).start()
+        return servidor
+
+
+# Registro global usado por Auth, Finance y Database
+metricas = Metrics()
+
+
+class OracleBackend:
+    """Backend Oracle: conexión directa por sentencia o pool de sesiones oracledb."""
+
+    LIMITE = " FETCH FIRST :n ROWS ONLY"
+
+    TABLA_VERSION = """
+        CREATE TABLE schema_version(
+            version NUMBER PRIMARY KEY,
+            descripcion VARCHAR2(100) NOT NULL,
+            aplicada DATE NOT NULL
+        )
+        """
+
+    # (versión, descripción, sentencias). Las versiones solo se agregan al final:
+    # una migración ya publicada no se modifica.
+    MIGRACIONES = [
+        (1, "tablas USERS e historial_consultas", [
             """
             CREATE TABLE USERS(
                 id NUMBER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
@@ -51,7 +245,7 @@ class Database:
                 password VARCHAR2(128) NOT NULL
             )
             """,
-            
+
             """
             CREATE TABLE historial_consultas(
                 id NUMBER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
@@ -62,114 +256,1556 @@ class Database:
                 fecha_consulta DATE NOT NULL,
                 fuente VARCHAR2(100) NOT NULL
             )
+            """,
+        ]),
+
+        # Soporta la paginación por keyset de fetch_history sin recorrer la tabla
+        (2, "índice historial_usuario_fecha_ix", [
             """
+            CREATE INDEX historial_usuario_fecha_ix
+                ON historial_consultas(usuario, fecha_consulta, id)
+            """,
+        ]),
 
-        ]
+        # Destino de la sentencia "insertar_indicator_log", que no tenía tabla
+        (3, "tabla indicator_log", [
+            """
+            CREATE TABLE indicator_log(
+                id NUMBER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+                indicator_name VARCHAR2(20) NOT NULL,
+                indicator_value NUMBER NOT NULL,
+                indicator_date DATE NOT NULL,
+                query_date DATE NOT NULL,
+                username VARCHAR2(32) NOT NULL,
+                source VARCHAR2(100) NOT NULL
+            )
+            """,
+        ]),
+    ]
 
-        for table in tables:
-            try:
-                self.query(table.strip())
-            except Exception:
-                pass
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        dsn: str,
+        pool_min: int = 0,
+        pool_max: int = 0,
+        pool_increment: int = 1,
+        ping_interval: int = 60,
+        stmtcachesize: int = 40,
+    ):
+        """
+        Con pool_max > 0 se crea un pool de sesiones oracledb compartido por todas las
+        llamadas a query(); con pool_max = 0 se mantiene una conexión nueva por sentencia.
+        ping_interval (segundos) controla el chequeo de salud al adquirir: las conexiones
+        inactivas por más de ese tiempo se verifican con un ping antes de entregarse
+        (0 = verificar siempre, -1 = nunca). stmtcachesize es el tamaño de la caché de
+        sentencias preparadas de cada conexión.
+        """
+        self.username = username
+        self.dsn = dsn
+        self.password = password
+        self.stmtcachesize = stmtcachesize
+        self.pool = None
+        # Atributo de instancia (no de clase) para no importar oracledb al cargar el módulo
+        self.Error = oracledb.DatabaseError
+        if pool_max > 0:
+            self.pool = oracledb.create_pool(
+                user=username,
+                password=password,
+                dsn=dsn,
+                min=pool_min,
+                max=pool_max,
+                increment=pool_increment,
+                ping_interval=ping_interval,
+                getmode=oracledb.POOL_GETMODE_WAIT,
+                stmtcachesize=stmtcachesize,
+            )
+
+    @staticmethod
+    def ya_existe(error: Exception) -> bool:
+        # ORA-00955: nombre ya usado; ORA-01408: columnas ya indexadas
+        return getattr(error.args[0], "code", None) in (955, 1408)
+
+    def get_connection(self):
+        # Una conexión del pool vuelve al pool al cerrarse (p. ej. al salir del "with")
+        if self.pool is not None:
+            return self.pool.acquire()
+        return oracledb.connect(user=self.username, password=self.password, dsn=self.dsn, stmtcachesize=self.stmtcachesize)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close(force=True)
+            self.pool = None
+
+
+def _sqlite_fecha(valor: Union[datetime.date, datetime.datetime]) -> str:
+    # DATE de Oracle guarda fecha y hora; en SQLite se guarda siempre como
+    # "yyyy-mm-dd hh:mm:ss" para que las comparaciones de texto sean cronológicas
+    if isinstance(valor, datetime.datetime):
+        return valor.isoformat(" ", "seconds")
+    return f"{valor.isoformat()} 00:00:00"
+
+
+sqlite3.register_adapter(datetime.date, _sqlite_fecha)
+sqlite3.register_adapter(datetime.datetime, _sqlite_fecha)
+sqlite3.register_converter("DATE", lambda b: datetime.datetime.fromisoformat(b.decode("ascii")))
+
+
+class ConexionesSQLite:
+    """
+    Una conexión SQLite en modo WAL por hilo (un objeto sqlite3 no debe usarse desde
+    dos hilos a la vez), reutilizada entre sentencias. La usan SQLiteBackend e
+    IndicatorStore. close() cierra las conexiones de todos los hilos; un hilo que
+    vuelva a pedir la suya después recibe una nueva. Las conexiones de hilos que ya
+    terminaron se cierran al abrir la siguiente.
+    """
+
+    def __init__(self, path: str, **opciones):
+        self.path = path
+        self.opciones = opciones
+        self._local = threading.local()
+        self._abiertas: "dict[threading.Thread, sqlite3.Connection]" = {}
+        self._generacion = 0
+        self._lock = threading.Lock()
+
+    def conexion(self) -> sqlite3.Connection:
+        propia = getattr(self._local, "conn", None)
+        if propia is not None and propia[0] == self._generacion:
+            return propia[1]
+        # check_same_thread=False solo para que close() pueda cerrarlas desde otro hilo
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, **self.opciones)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock:
+            terminadas = [hilo for hilo in self._abiertas if not hilo.is_alive()]
+            huerfanas = [self._abiertas.pop(hilo) for hilo in terminadas]
+            self._abiertas[threading.current_thread()] = conn
+            self._local.conn = (self._generacion, conn)
+        for vieja in huerfanas:
+            vieja.close()
+        return conn
+
+    def cerrar_hilo(self):
+        """Cierra solo la conexión del hilo actual (p. ej. al terminar un hilo de trabajo)."""
+        propia = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if propia is not None:
+            with self._lock:
+                if self._abiertas.get(threading.current_thread()) is propia[1]:
+                    del self._abiertas[threading.current_thread()]
+            propia[1].close()
+
+    def close(self):
+        with self._lock:
+            abiertas, self._abiertas = list(self._abiertas.values()), {}
+            self._generacion += 1
+        for conn in abiertas:
+            conn.close()
+
+
+class SQLiteBackend:
+    """
+    Backend embebido SQLite (modo WAL) para nodos únicos o kioscos sin Oracle. Acepta
+    el mismo estilo de binds :nombre y devuelve las columnas DATE como datetime, igual
+    que oracledb. Usa una conexión por hilo, reutilizada entre sentencias.
+    """
+
+    Error = sqlite3.Error
+    LIMITE = " LIMIT :n"
+
+    TABLA_VERSION = """
+        CREATE TABLE IF NOT EXISTS schema_version(
+            version INTEGER PRIMARY KEY,
+            descripcion VARCHAR(100) NOT NULL,
+            aplicada DATE NOT NULL
+        )
+        """
+
+    MIGRACIONES = [
+        (1, "tablas USERS e historial_consultas", [
+            """
+            CREATE TABLE IF NOT EXISTS USERS(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username VARCHAR(32) UNIQUE NOT NULL,
+                password VARCHAR(128) NOT NULL
+            )
+            """,
+
+            """
+            CREATE TABLE IF NOT EXISTS historial_consultas(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                usuario VARCHAR(32) NOT NULL,
+                indicador VARCHAR(20) NOT NULL,
+                valor REAL NOT NULL,
+                fecha_indicador DATE NOT NULL,
+                fecha_consulta DATE NOT NULL,
+                fuente VARCHAR(100) NOT NULL
+            )
+            """,
+        ]),
+
+        (2, "índice historial_usuario_fecha_ix", [
+            """
+            CREATE INDEX IF NOT EXISTS historial_usuario_fecha_ix
+                ON historial_consultas(usuario, fecha_consulta, id)
+            """,
+        ]),
+
+        (3, "tabla indicator_log", [
+            """
+            CREATE TABLE IF NOT EXISTS indicator_log(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                indicator_name VARCHAR(20) NOT NULL,
+                indicator_value REAL NOT NULL,
+                indicator_date DATE NOT NULL,
+                query_date DATE NOT NULL,
+                username VARCHAR(32) NOT NULL,
+                source VARCHAR(100) NOT NULL
+            )
+            """,
+        ]),
+    ]
+
+    def __init__(self, path: str = "ecotech.sqlite3", stmtcachesize: int = 40):
+        self.path = path
+        self.stmtcachesize = stmtcachesize
+        self._conexiones = ConexionesSQLite(
+            path, detect_types=sqlite3.PARSE_DECLTYPES, cached_statements=stmtcachesize
+        )
+
+    @staticmethod
+    def ya_existe(error: Exception) -> bool:
+        # Las migraciones usan IF NOT EXISTS; esto cubre bases creadas a mano
+        return "already exists" in str(error)
+
+    @contextlib.contextmanager
+    def get_connection(self):
+        conn = self._conexiones.conexion()
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def close(self):
+        self._conexiones.close()
+
+
+class Database:
+    # Sentencias con nombre: el texto es siempre idéntico, así que cada conexión la
+    # analiza una sola vez y luego la reutiliza desde su caché de sentencias.
+    SENTENCIAS = {
+        "usuario_por_nombre": "SELECT id, username, password FROM USERS WHERE username = :username",
+        "insertar_usuario": "INSERT INTO USERS(username,password) VALUES (:username, :password)",
+        "actualizar_password": "UPDATE USERS SET password = :password WHERE id = :id",
+        "insertar_historial": (
+            "INSERT INTO historial_consultas("
+            "usuario, indicador, valor, fecha_indicador, fecha_consulta, fuente"
+            ") VALUES (:usr, :ind, :val, :f_ind, :f_cons, :src)"
+        ),
+        "insertar_indicator_log": (
+            "INSERT INTO indicator_log("
+            "indicator_name, indicator_value, indicator_date, query_date, username, source"
+            ") VALUES (:name, :value, :ind_date, :qry_date, :username, :source)"
+        ),
+    }
+
+    def __init__(
+        self,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        dsn: Optional[str] = None,
+        pool_min: int = 0,
+        pool_max: int = 0,
+        pool_increment: int = 1,
+        ping_interval: int = 60,
+        stmtcachesize: int = 40,
+        backend=None,
+    ):
+        """
+        Sin `backend` se usa OracleBackend con los parámetros de conexión y de pool
+        recibidos; para SQLite pasar backend=SQLiteBackend(path).
+        """
+        if backend is None:
+            backend = OracleBackend(
+                username,
+                password,
+                dsn,
+                pool_min=pool_min,
+                pool_max=pool_max,
+                pool_increment=pool_increment,
+                ping_interval=ping_interval,
+                stmtcachesize=stmtcachesize,
+            )
+        self.backend = backend
+        self.sentencias = dict(Database.SENTENCIAS)
+        self._es_select = {}
+
+    def get_connection(self):
+        return self.backend.get_connection()
+
+    @contextlib.contextmanager
+    def _conexion(self):
+        inicio = time.perf_counter()
+        with self.get_connection() as conn:
+            metricas.observar("db_acquire", time.perf_counter() - inicio)
+            yield conn
+
+    def _error(self, error: Exception):
+        metricas.contar("errores_total", operacion="db")
+        print("Error de base de datos:", error)
+
+    def close(self):
+        self.backend.close()
+   
+    def schema_version(self) -> Optional[int]:
+        """Versión aplicada del esquema: 0 si schema_version está vacía, None si no existe."""
+        try:
+            with self._conexion() as conn:
+                with contextlib.closing(conn.cursor()) as cur:
+                    cur.execute("SELECT MAX(version) FROM schema_version")
+                    (version,) = cur.fetchone()
+                    return version or 0
+        except self.backend.Error:
+            return None
+
+    def migrate(self) -> List[int]:
+        """
+        Aplica las migraciones de backend.MIGRACIONES con versión mayor a la registrada
+        en schema_version y devuelve las versiones aplicadas. Con el esquema al día solo
+        se ejecuta una consulta y ningún DDL. Cada versión se registra al terminar, así
+        que una migración interrumpida se reintenta en el próximo arranque; los objetos
+        que ya existían (bases creadas antes de schema_version) se dan por creados.
+        """
+        actual = self.schema_version()
+        pendientes = [m for m in self.backend.MIGRACIONES if m[0] > (actual or 0)]
+        aplicadas = []
+        if not pendientes:
+            return aplicadas
+        try:
+            with self._conexion() as conn:
+                with contextlib.closing(conn.cursor()) as cur:
+                    if actual is None:
+                        self._ddl(cur, self.backend.TABLA_VERSION)
+                    for version, descripcion, sentencias in pendientes:
+                        for sql in sentencias:
+                            self._ddl(cur, sql)
+                        cur.execute(
+                            "INSERT INTO schema_version(version, descripcion, aplicada) VALUES (:v, :d, :f)",
+                            {"v": version, "d": descripcion, "f": datetime.datetime.now()},
+                        )
+                        conn.commit()
+                        aplicadas.append(version)
+        except self.backend.Error as error:
+            self._error(error)
+        return aplicadas
+
+    def _ddl(self, cur, sql: str):
+        try:
+            with metricas.medir("db_ddl"):
+                cur.execute(sql.strip())
+        except self.backend.Error as error:
+            if not self.backend.ya_existe(error):
+                raise
+
+    def create_all_tables(self):
+        # Nombre anterior de migrate(), se mantiene para los llamadores existentes
+        self.migrate()
+
+    def register(self, nombre: str, sql: str):
+        self.sentencias[nombre] = sql.strip()
+
+    def _sql(self, sentencia: str) -> str:
+        # Acepta el nombre de una sentencia registrada o el texto SQL directamente
+        return self.sentencias.get(sentencia, sentencia)
+
+    def fetch(self, sentencia: str, parameters: Optional[dict] = None) -> Optional[list]:
+        try:
+            with self._conexion() as conn:
+                with contextlib.closing(conn.cursor()) as cur:
+                    with metricas.medir("db_execute"):
+                        return list(cur.execute(self._sql(sentencia), parameters or {}))
+        except self.backend.Error as error:
+            self._error(error)
+            return None
+
+    def stream(
+        self,
+        sentencia: str,
+        parameters: Optional[dict] = None,
+        arraysize: int = 1000,
+        prefetchrows: int = 1000,
+    ) -> Iterator[tuple]:
+        """
+        Generador de filas para SELECT grandes: trae de a `arraysize` filas por viaje
+        (las primeras `prefetchrows` llegan junto con la ejecución) en lugar de cargar
+        todo el resultado en memoria. La conexión queda tomada hasta terminar de iterar.
+        A diferencia de fetch(), un error de base de datos se relanza (tras contarlo):
+        una conexión caída a mitad de la lectura no debe parecer un resultado completo.
+        """
+        try:
+            with self._conexion() as conn:
+                with contextlib.closing(conn.cursor()) as cur:
+                    cur.arraysize = arraysize
+                    if hasattr(cur, "prefetchrows"):
+                        cur.prefetchrows = prefetchrows
+                    with metricas.medir("db_execute"):
+                        cur.execute(self._sql(sentencia), parameters or {})
+                    while True:
+                        filas = cur.fetchmany()
+                        if not filas:
+                            break
+                        yield from filas
+        except self.backend.Error as error:
+            self._error(error)
+            raise
+
+    def execute(self, sentencia: str, parameters: Optional[dict] = None) -> Optional[int]:
+        """Ejecuta DML/DDL y hace commit. Devuelve las filas afectadas, o None si hubo error."""
+        try:
+            with self._conexion() as conn:
+                with contextlib.closing(conn.cursor()) as cur:
+                    with metricas.medir("db_execute"):
+                        cur.execute(self._sql(sentencia), parameters or {})
+                    filas = cur.rowcount
+                with metricas.medir("db_commit"):
+                    conn.commit()
+            return filas
+        except self.backend.Error as error:
+            self._error(error)
+            return None
 
     def query(self, sql: str, parameters: Optional[dict] = None):
+        # Interfaz antigua: decide entre fetch y execute según el texto (una vez por SQL)
+        es_select = self._es_select.get(sql)
+        if es_select is None:
+            es_select = self._es_select[sql] = self._sql(sql).strip().upper().startswith("SELECT")
+        if es_select:
+            return self.fetch(sql, parameters)
+        self.execute(sql, parameters)
+
+    def fetch_history(
+        self,
+        user: str,
+        after_cursor: Optional[Tuple[datetime.date, int]] = None,
+        page_size: int = 50,
+    ) -> dict:
+        """
+        Página de historial_consultas del usuario, de la más reciente a la más antigua.
+        after_cursor es el "next_cursor" de la página anterior (None = primera página).
+        Devuelve {"rows": [(indicador, fecha_indicador, valor, fecha_consulta, fuente)],
+        "next_cursor": (fecha_consulta, id) o None si no hay más filas}.
+        """
+        parametros = {"usr": user, "n": page_size + 1}
+        filtro = ""
+        if after_cursor is not None:
+            filtro = " AND (fecha_consulta < :f_cur OR (fecha_consulta = :f_cur AND id < :id_cur))"
+            parametros["f_cur"], parametros["id_cur"] = after_cursor
+        filas = self.fetch(
+            "SELECT indicador, fecha_indicador, valor, fecha_consulta, fuente, id "
+            "FROM historial_consultas WHERE usuario = :usr" + filtro +
+            " ORDER BY fecha_consulta DESC, id DESC" + self.backend.LIMITE,
+            parametros,
+        ) or []
+        hay_mas = len(filas) > page_size
+        filas = filas[:page_size]
+        return {
+            "rows": [f[:5] for f in filas],
+            "next_cursor": (filas[-1][3], filas[-1][5]) if hay_mas else None,
+        }
+
+    def query_many(self, sentencia: str, filas: List[dict]) -> Optional[int]:
+        """
+        Ejecuta la misma sentencia DML para todas las filas con executemany (array
+        binding): un solo viaje a la base de datos y un solo commit.
+        Devuelve la cantidad de filas enviadas, o None si hubo error.
+        """
+        if not filas:
+            return 0
+        try:
+            with self._conexion() as conn:
+                with contextlib.closing(conn.cursor()) as cur:
+                    with metricas.medir("db_execute"):
+                        cur.executemany(self._sql(sentencia), filas)
+                with metricas.medir("db_commit"):
+                    conn.commit()
+            return len(filas)
+        except self.backend.Error as error:
+            self._error(error)
+            return None
+
+
+def database_desde_env() -> Database:
+    """Database según ECOTECH_DB ("oracle" por defecto o "sqlite") y las variables ORACLE_* / ECOTECH_SQLITE."""
+    if os.getenv("ECOTECH_DB", "oracle").lower() == "sqlite":
+        return Database(backend=SQLiteBackend(os.getenv("ECOTECH_SQLITE", "ecotech.sqlite3")))
+    return Database(
+        username=os.getenv("ORACLE_USER"),
+        password=os.getenv("ORACLE_PASSWORD"),
+        dsn=os.getenv("ORACLE_DSN"),
+        pool_min=int(os.getenv("ORACLE_POOL_MIN", "1")),
+        pool_max=int(os.getenv("ORACLE_POOL_MAX", "4")),
+        pool_increment=int(os.getenv("ORACLE_POOL_INCREMENT", "1")),
+    )
+
+
+class ColaLlena(RuntimeError):
+    pass
+
+
+class BufferedWriter:
+    """
+    Acumula filas para una misma sentencia INSERT (nombre registrado o SQL) y las
+    escribe con Database.query_many cuando el buffer llega a max_filas o cuando la
+    fila más antigua cumple max_edad segundos. Si la escritura falla, las filas vuelven
+    al buffer y solo el timer las reintenta cada max_edad segundos, sin que add()
+    golpee la base caída en el hilo del llamador. Con max_pendientes filas en espera,
+    add() lanza ColaLlena. Llamar a close() (o usarlo con "with") para vaciar lo
+    pendiente; si aún quedan filas sin escribir, close() lanza RuntimeError.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        sentencia: str,
+        max_filas: int = 500,
+        max_edad: float = 5.0,
+        max_pendientes: Optional[int] = None,
+    ):
+        self.db = db
+        self.sentencia = sentencia
+        self.max_filas = max_filas
+        self.max_edad = max_edad
+        self.max_pendientes = max_pendientes if max_pendientes is not None else 20 * max_filas
+        self._filas: List[dict] = []
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._reintentando = False
+
+    def add(self, fila: dict):
+        with self._lock:
+            if len(self._filas) >= self.max_pendientes:
+                metricas.contar("filas_rechazadas_total", operacion="buffered_writer")
+                raise ColaLlena(f"{len(self._filas)} filas pendientes sin poder escribirse")
+            self._filas.append(fila)
+            lleno = len(self._filas) >= self.max_filas and not self._reintentando
+            if not lleno:
+                self._programar()
+        if lleno:
+            self.flush()
+
+    def _programar(self):
+        # Se llama con el lock tomado
+        if self._timer is None:
+            self._timer = threading.Timer(self.max_edad, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self) -> Optional[int]:
+        """Escribe lo pendiente; devuelve las filas escritas o None si falló (quedan en el buffer)."""
+        with self._lock:
+            filas, self._filas = self._filas, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not filas:
+            return 0
+        escritas = self.db.query_many(self.sentencia, filas)
+        with self._lock:
+            self._reintentando = escritas is None
+            if escritas is None:
+                metricas.contar("errores_total", operacion="buffered_writer")
+                self._filas[:0] = filas
+                self._programar()
+        return escritas
+
+    def pendientes(self) -> int:
+        with self._lock:
+            return len(self._filas)
+
+    def close(self):
+        if self.flush() is None:
+            raise RuntimeError(f"No se pudieron escribir {self.pendientes()} filas pendientes")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _bcrypt_hash(password: bytes, rounds: int) -> bytes:
+    # Funciones de módulo para que ProcessPoolExecutor pueda enviarlas a otro proceso
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+
+def _bcrypt_check(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+class PasswordHasher:
+    """bcrypt en el mismo hilo que llama; `rounds` es el factor de costo de los hashes nuevos."""
+
+    def __init__(self, rounds: int = 12):
+        self.rounds = rounds
+
+    def hash(self, password: str) -> bytes:
+        return _bcrypt_hash(password.encode("UTF-8"), self.rounds)
+
+    def check(self, password: str, hashed: bytes) -> bool:
+        return _bcrypt_check(password.encode("UTF-8"), hashed)
+
+    def close(self):
+        pass
+
+
+class BcryptPool(PasswordHasher):
+    """
+    Envía bcrypt a un pool de procesos para que varios logins usen varios núcleos en
+    paralelo. max_pendientes limita cuántas operaciones pueden estar en cola o en curso;
+    si no hay cupo en `espera` segundos se lanza ColaLlena en vez de seguir acumulando.
+    """
+
+    def __init__(self, rounds: int = 12, workers: Optional[int] = None, max_pendientes: int = 64, espera: float = 5.0):
+        super().__init__(rounds)
+        self.espera = espera
+        self._ejecutor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        self._cupos = threading.BoundedSemaphore(max_pendientes)
+
+    def _enviar(self, funcion, *args) -> Future:
+        if not self._cupos.acquire(timeout=self.espera):
+            raise ColaLlena("Demasiadas verificaciones de contraseña pendientes")
+        return self._someter(funcion, *args)
+
+    async def _enviar_async(self, funcion, *args):
+        # La espera de cupo corre en un hilo aparte para no bloquear el event loop
+        if not self._cupos.acquire(blocking=False):
+            espera = asyncio.ensure_future(asyncio.to_thread(self._cupos.acquire, timeout=self.espera))
+            try:
+                adquirido = await asyncio.shield(espera)
+            except asyncio.CancelledError:
+                # Si el cupo llega después de cancelar, se devuelve
+                espera.add_done_callback(lambda t: t.result() and self._cupos.release())
+                raise
+            if not adquirido:
+                raise ColaLlena("Demasiadas verificaciones de contraseña pendientes")
+        return await asyncio.wrap_future(self._someter(funcion, *args))
+
+    def _someter(self, funcion, *args) -> Future:
+        # Se llama con el cupo ya tomado; se libera al terminar la tarea
+        try:
+            futuro = self._ejecutor.submit(funcion, *args)
+        except BaseException:
+            self._cupos.release()
+            raise
+        futuro.add_done_callback(lambda _: self._cupos.release())
+        return futuro
+
+    def hash(self, password: str) -> bytes:
+        return self._enviar(_bcrypt_hash, password.encode("UTF-8"), self.rounds).result()
+
+    def check(self, password: str, hashed: bytes) -> bool:
+        return self._enviar(_bcrypt_check, password.encode("UTF-8"), hashed).result()
+
+    async def hash_async(self, password: str) -> bytes:
+        return await self._enviar_async(_bcrypt_hash, password.encode("UTF-8"), self.rounds)
+
+    async def check_async(self, password: str, hashed: bytes) -> bool:
+        return await self._enviar_async(_bcrypt_check, password.encode("UTF-8"), hashed)
+
+    def close(self):
+        self._ejecutor.shutdown(wait=True, cancel_futures=True)
+
+
+class TokenBucketLimiter:
+    """
+    Limitador token bucket por clave: cada clave acumula hasta `capacidad` intentos y
+    recupera `recarga` intentos por segundo. Se recuerdan como máximo max_claves claves
+    (LRU); una clave olvidada vuelve con el bucket lleno.
+    """
+
+    def __init__(self, capacidad: float = 5, recarga: float = 0.1, max_claves: int = 10_000):
+        self.capacidad = capacidad
+        self.recarga = recarga
+        self.max_claves = max_claves
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def permitir(self, clave: str) -> bool:
+        ahora = time.monotonic()
+        with self._lock:
+            tokens, ultimo = self._buckets.get(clave, (self.capacidad, ahora))
+            tokens = min(self.capacidad, tokens + (ahora - ultimo) * self.recarga)
+            permitido = tokens >= 1
+            if permitido:
+                tokens -= 1
+            self._buckets[clave] = (tokens, ahora)
+            self._buckets.move_to_end(clave)
+            while len(self._buckets) > self.max_claves:
+                self._buckets.popitem(last=False)
+            return permitido
+
+
+class NegativeCache:
+    """Recuerda por `ttl` segundos claves que no existen (p. ej. usuarios desconocidos)."""
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 10_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._expira: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, clave: str) -> bool:
+        with self._lock:
+            expira = self._expira.get(clave)
+            if expira is None:
+                return False
+            if time.monotonic() >= expira:
+                del self._expira[clave]
+                return False
+            return True
+
+    def add(self, clave: str):
+        with self._lock:
+            self._expira[clave] = time.monotonic() + self.ttl
+            self._expira.move_to_end(clave)
+            while len(self._expira) > self.max_entries:
+                self._expira.popitem(last=False)
+
+    def discard(self, clave: str):
+        with self._lock:
+            self._expira.pop(clave, None)
+
+
+class SessionManager:
+    """
+    Emite tokens firmados (HMAC-SHA256) con vencimiento para no repetir la consulta a
+    Oracle ni bcrypt en cada operación. Los tokens validados quedan en una tabla en
+    memoria (LRU de max_sesiones) para que la siguiente validación sea un simple lookup;
+    un token que no está en la tabla se acepta si su firma y vencimiento son válidos.
+    Con `ruta_revocados` las revocaciones se anotan en ese archivo y se vuelven a
+    cargar al iniciar, para que un token revocado no reviva tras un reinicio.
+    """
+
+    def __init__(
+        self,
+        secreto: Optional[bytes] = None,
+        ttl: float = 8 * 3600,
+        max_sesiones: int = 10_000,
+        ruta_revocados: Optional[str] = None,
+    ):
+        # Sin secreto fijo los tokens solo sirven mientras viva el proceso: no deben
+        # guardarse en disco para reanudar la sesión en otra ejecución
+        self.persistente = bool(secreto)
+        self.secreto = secreto or secrets.token_bytes(32)
+        self.ttl = ttl
+        self.max_sesiones = max_sesiones
+        self._sesiones: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._revocados = NegativeCache(ttl=ttl, max_entries=max_sesiones)
+        self._lock = threading.Lock()
+        self.ruta_revocados = ruta_revocados if self.persistente else None
+        if self.ruta_revocados:
+            self._cargar_revocados()
+
+    def _leer_revocados(self) -> Tuple[List[Tuple[float, str]], int]:
+        # Una línea "expira token" por revocación; devuelve (vigentes, cantidad de vencidas)
+        try:
+            with open(self.ruta_revocados, encoding="UTF-8") as archivo:
+                lineas = [linea.split() for linea in archivo]
+        except OSError:
+            return [], 0
+        ahora = time.time()
+        entradas = [(float(expira), token) for expira, token in (l for l in lineas if len(l) == 2)]
+        vigentes = [(expira, token) for expira, token in entradas if expira > ahora]
+        return vigentes, len(entradas) - len(vigentes)
+
+    def _cargar_revocados(self):
+        # Solo lectura: se llama al importar el módulo (también en cada proceso de BcryptPool)
+        for _, token in self._leer_revocados()[0]:
+            self._revocados.add(token)
+
+    def _firma(self, payload: bytes) -> str:
+        digest = hmac.new(self.secreto, payload, hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).decode("ascii").rstrip("=")
+
+    def _recordar(self, token: str, username: str, expira: float):
+        with self._lock:
+            self._sesiones[token] = (username, expira)
+            self._sesiones.move_to_end(token)
+            while len(self._sesiones) > self.max_sesiones:
+                self._sesiones.popitem(last=False)
+
+    def issue(self, username: str) -> str:
+        expira = time.time() + self.ttl
+        payload = f"{username}|{int(expira)}|{secrets.token_hex(8)}".encode("UTF-8")
+        token = base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=") + "." + self._firma(payload)
+        self._recordar(token, username, expira)
+        return token
+
+    def validate(self, token: str) -> Optional[str]:
+        """Devuelve el usuario dueño del token, o None si es inválido, vencido o revocado."""
+        with self._lock:
+            sesion = self._sesiones.get(token)
+            if sesion is not None:
+                if time.time() < sesion[1]:
+                    self._sesiones.move_to_end(token)
+                    return sesion[0]
+                del self._sesiones[token]
+                return None
+        if token in self._revocados:
+            return None
         try:
-            with self.get_connection() as conn:
-                with conn.cursor() as cur:
-                    ejecucion = cur.execute(sql, parameters or {})
-                    if sql.strip().upper().startswith("SELECT"):
-                        return list(ejecucion)
-                conn.commit()
-        except oracledb.DatabaseError as error:
-            print("Error de base de datos:", error)
+            cuerpo, firma = token.split(".")
+            payload = base64.urlsafe_b64decode(cuerpo + "=" * (-len(cuerpo) % 4))
+            # En bytes: compare_digest rechaza str con caracteres no ASCII (TypeError)
+            if not hmac.compare_digest(firma.encode("UTF-8"), self._firma(payload).encode("ascii")):
+                return None
+            username, expira, _ = payload.decode("UTF-8").split("|")
+        except ValueError:
             return None
+        if time.time() >= int(expira):
+            return None
+        self._recordar(token, username, int(expira))
+        return username
+
+    def revoke(self, token: str):
+        with self._lock:
+            self._sesiones.pop(token, None)
+            if self.ruta_revocados:
+                self._anotar_revocado(token)
+        self._revocados.add(token)
+
+    def _anotar_revocado(self, token: str):
+        # Agrega al final; si hay entradas vencidas, reescribe el archivo sin ellas
+        # con un reemplazo atómico para que un lector nunca lo vea a medio escribir
+        linea = f"{time.time() + self.ttl} {token}\n"
+        vigentes, vencidas = self._leer_revocados()
+        if not vencidas:
+            with open(self.ruta_revocados, "a", encoding="UTF-8") as archivo:
+                archivo.write(linea)
+            return
+        temporal = f"{self.ruta_revocados}.{os.getpid()}.tmp"
+        with open(temporal, "w", encoding="UTF-8") as archivo:
+            archivo.writelines(f"{expira} {t}\n" for expira, t in vigentes)
+            archivo.write(linea)
+        os.replace(temporal, self.ruta_revocados)
+
 
 class Auth: 
+    # Reemplazable por BcryptPool(...) para verificar en paralelo en varios procesos
+    hasher: PasswordHasher = PasswordHasher()
+    # Frenan ráfagas de intentos antes de llegar a Oracle o a bcrypt
+    limitador_usuario = TokenBucketLimiter(capacidad=5, recarga=0.1)
+    limitador_cliente = TokenBucketLimiter(capacidad=20, recarga=1.0)
+    usuarios_inexistentes = NegativeCache(ttl=60.0)
+    sesiones = SessionManager(
+        secreto=os.getenv("SESSION_SECRET", "").encode("UTF-8") or None,
+        ttl=float(os.getenv("SESSION_TTL", str(8 * 3600))),
+        ruta_revocados=os.getenv("SESSION_REVOCADOS", ".ecotech_revocados"),
+    )
+
+    @staticmethod
+    def _leer_hash(almacenado: str) -> bytes:
+        # Formato actual: "$2b$12$..." tal cual; formato antiguo: el mismo hash en hexadecimal
+        if almacenado.startswith("$2"):
+            return almacenado.encode("ascii")
+        return bytes.fromhex(almacenado)
+
+    @staticmethod
+    def _costo(hashed: bytes) -> int:
+        return int(hashed.split(b"$")[2])
+
+    @staticmethod
+    def _rehash_si_corresponde(db: Database, user_id: int, password: str, almacenado: str, hashed: bytes):
+        """
+        Tras un login correcto, si el hash guardado está en hexadecimal o su costo no es
+        el configurado en Auth.hasher.rounds, se recalcula y se guarda en formato "$2b$".
+        Un fallo aquí no impide el login: se reintentará en el siguiente.
+        """
+        try:
+            if not almacenado.startswith("$2") or Auth._costo(hashed) != Auth.hasher.rounds:
+                with metricas.medir("bcrypt"):
+                    nuevo = Auth.hasher.hash(password)
+                db.execute("actualizar_password", {"id": user_id, "password": nuevo.decode("ascii")})
+        except Exception as e:
+            print("No se pudo actualizar el hash de la contraseña:", e)
+
     @staticmethod 
     def register(db: Database, username: str, password: str) -> dict: 
         if not validar_username(username): 
             return {"success": False, "message": "Usuario inválido. Debe ser alfanumérico (._-) y de 3 a 32 caracteres."} 
         if not validar_password(password): 
             return {"success": False, "message": "Contraseña inválida. Debe tener entre 8 y 128 caracteres con letras y números."} 
-        salt = bcrypt.gensalt(rounds=12) 
-        hash_password = bcrypt.hashpw(password.encode("UTF-8"), salt) 
-        hash_hex = hash_password.hex() 
         try: 
-            db.query( sql="INSERT INTO USERS(username,password) VALUES (:username, :password)", parameters={"username": username, "password": hash_hex} ) 
+            with metricas.medir("bcrypt"):
+                hash_password = Auth.hasher.hash(password)
+        except ColaLlena:
+            return {"success": False, "message": "Servidor ocupado, intente nuevamente."}
+        try: 
+            # execute() devuelve None si la base rechazó el INSERT (p. ej. usuario repetido)
+            if db.execute("insertar_usuario", {"username": username, "password": hash_password.decode("ascii")}) is None:
+                return {"success": False, "message": "No se pudo registrar el usuario: ya existe o la base no está disponible."}
+            Auth.usuarios_inexistentes.discard(username)
             
             return {"success": True, "message": "Usuario registrado con éxito"} 
         except Exception as e: 
             return {"success": False, "message": f"No se pudo registrar el usuario: {e}"}
     @staticmethod
-    def login(db: Database, username: str, password: str) -> dict: 
+    def login(db: Database, username: str, password: str, cliente: Optional[str] = None) -> dict: 
         if not validar_username(username) or not validar_password(password): 
             return {"success": False, "message": "Credenciales con formato inválido."} 
-        resultado = db.query( sql="SELECT id, username, password FROM USERS WHERE username = :username", parameters={"username": username} ) 
+        if not Auth.limitador_usuario.permitir(username) or (cliente and not Auth.limitador_cliente.permitir(cliente)):
+            return {"success": False, "message": "Demasiados intentos, espere un momento."}
+        if username in Auth.usuarios_inexistentes:
+            return {"success": False, "message": "No hay coincidencias"} 
+        resultado = db.fetch("usuario_por_nombre", {"username": username})
         if not resultado: 
+            if resultado is not None:
+                Auth.usuarios_inexistentes.add(username)
             return {"success": False, "message": "No hay coincidencias"} 
-        hashed_hex = resultado[0][2] 
+        user_id, hashed_guardado = resultado[0][0], resultado[0][2]
         try: 
-            hashed_password = bytes.fromhex(hashed_hex) 
+            hashed_password = Auth._leer_hash(hashed_guardado)
         except ValueError: 
             return {"success": False, "message": "Formato de hash inválido en base de datos."} 
-        if bcrypt.checkpw(password.encode("UTF-8"), hashed_password): 
-            return {"success": True, "message": "Logeado correctamente"} 
+        try:
+            with metricas.medir("bcrypt"):
+                valida = Auth.hasher.check(password, hashed_password)
+        except ColaLlena:
+            return {"success": False, "message": "Servidor ocupado, intente nuevamente."}
+        if valida: 
+            Auth._rehash_si_corresponde(db, user_id, password, hashed_guardado, hashed_password)
+            return {"success": True, "message": "Logeado correctamente", "token": Auth.sesiones.issue(username)} 
         else: 
             return {"success": False, "message": "Contraseña incorrecta"}
 
 
+class IndicadorSinDatos(ValueError):
+    pass
+
+
+class SingleFlight:
+    """
+    Agrupa llamadas concurrentes con la misma clave: el primer hilo ejecuta la función
+    y los demás esperan y reciben su mismo resultado (o su misma excepción).
+    """
+
+    class _Llamada:
+        def __init__(self):
+            self.listo = threading.Event()
+            self.resultado = None
+            self.error: Optional[BaseException] = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._en_curso = {}
+
+    def do(self, clave, funcion):
+        with self._lock:
+            llamada = self._en_curso.get(clave)
+            lider = llamada is None
+            if lider:
+                llamada = self._en_curso[clave] = SingleFlight._Llamada()
+        if lider:
+            try:
+                llamada.resultado = funcion()
+            except BaseException as error:
+                llamada.error = error
+            finally:
+                with self._lock:
+                    del self._en_curso[clave]
+                llamada.listo.set()
+        else:
+            llamada.listo.wait()
+        if llamada.error is not None:
+            raise llamada.error
+        return llamada.resultado
+
+
+class IndicatorCache:
+    """
+    Caché en memoria de respuestas de mindicador.cl con clave (indicador, fecha).
+    El valor de una fecha pasada no cambia, así que se guarda sin expiración y solo
+    se desaloja por LRU al superar max_entries. La fecha de hoy (o futura) expira
+    tras ttl_hoy segundos.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl_hoy: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_hoy = ttl_hoy
+        self.hits = 0
+        self.misses = 0
+        self._datos: "OrderedDict[Tuple[str, datetime.date], Tuple[dict, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def clave(indicator: str, fecha: str) -> Tuple[str, datetime.date]:
+        # Acepta "d-m-yyyy" y "dd-mm-yyyy"; lanza ValueError si la fecha no es válida
+        fecha_obj = datetime.datetime.strptime(fecha.strip(), "%d-%m-%Y").date()
+        return indicator.strip().lower(), fecha_obj
+
+    def get(self, clave: Tuple[str, datetime.date]) -> Optional[dict]:
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                self.misses += 1
+                metricas.contar("cache_total", resultado="miss")
+                return None
+            valor, expira = entrada
+            if expira is not None and time.monotonic() >= expira:
+                del self._datos[clave]
+                self.misses += 1
+                metricas.contar("cache_total", resultado="expirado")
+                return None
+            self._datos.move_to_end(clave)
+            self.hits += 1
+            metricas.contar("cache_total", resultado="hit")
+            return dict(valor)
+
+    def __contains__(self, clave: Tuple[str, datetime.date]) -> bool:
+        # Como get() pero sin contar aciertos ni fallos
+        with self._lock:
+            entrada = self._datos.get(clave)
+            return entrada is not None and (entrada[1] is None or time.monotonic() < entrada[1])
+
+    def put(self, clave: Tuple[str, datetime.date], valor: dict, ttl: Optional[float] = None):
+        # `ttl` reemplaza a ttl_hoy para la fecha de hoy (p. ej. hasta el próximo prefetch)
+        if clave[1] < datetime.date.today():
+            expira = None
+        else:
+            expira = time.monotonic() + (self.ttl_hoy if ttl is None else ttl)
+        with self._lock:
+            self._datos[clave] = (dict(valor), expira)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entries:
+                self._datos.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._datos)}
+
+
+class IndicatorStore:
+    """
+    Almacén local persistente (SQLite en modo WAL) de valores ya consultados, para que
+    un reinicio no vuelva a pedir a la API las fechas pasadas. WAL permite varios
+    lectores concurrentes mientras otro proceso escribe. Cada 1000 escrituras un hilo
+    aparte revisa si hay más de max_rows filas y elimina las guardadas hace más
+    tiempo (compactar()).
+    """
+
+    def __init__(self, path: str = "indicadores.sqlite3", max_rows: int = 100_000):
+        self.path = path
+        self.max_rows = max_rows
+        self._conexiones = ConexionesSQLite(path)
+        self._escrituras = 0
+        self._lock = threading.Lock()
+        self._compactando = False
+        with self._conexion() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS valores ("
+                "  indicador TEXT NOT NULL,"
+                "  fecha TEXT NOT NULL,"
+                "  valor REAL NOT NULL,"
+                "  fecha_indicador TEXT NOT NULL,"
+                "  fuente TEXT NOT NULL,"
+                "  guardado REAL NOT NULL,"
+                "  PRIMARY KEY (indicador, fecha)"
+                ")"
+            )
+
+    def _conexion(self) -> sqlite3.Connection:
+        return self._conexiones.conexion()
+
+    def get(self, clave: Tuple[str, datetime.date]) -> Optional[dict]:
+        fila = self._conexion().execute(
+            "SELECT valor, fecha_indicador, fuente FROM valores WHERE indicador = ? AND fecha = ?",
+            (clave[0], clave[1].isoformat()),
+        ).fetchone()
+        if fila is None:
+            return None
+        return {
+            "value": fila[0],
+            "indicator_date": datetime.date.fromisoformat(fila[1]),
+            "source": fila[2],
+        }
+
+    def put(self, clave: Tuple[str, datetime.date], valor: dict):
+        # Solo se persisten fechas pasadas: el valor de hoy todavía puede cambiar
+        if clave[1] >= datetime.date.today():
+            return
+        with self._conexion() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO valores(indicador, fecha, valor, fecha_indicador, fuente, guardado) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    clave[0],
+                    clave[1].isoformat(),
+                    float(valor["value"]),
+                    valor["indicator_date"].isoformat(),
+                    valor["source"],
+                    time.time(),
+                ),
+            )
+        self._contar_escrituras(1)
+
+    def put_many(self, items: Iterable[Tuple[Tuple[str, datetime.date], dict]]):
+        hoy = datetime.date.today()
+        ahora = time.time()
+        filas = [
+            (
+                clave[0],
+                clave[1].isoformat(),
+                float(valor["value"]),
+                valor["indicator_date"].isoformat(),
+                valor["source"],
+                ahora,
+            )
+            for clave, valor in items
+            if clave[1] < hoy
+        ]
+        if not filas:
+            return
+        with self._conexion() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO valores(indicador, fecha, valor, fecha_indicador, fuente, guardado) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                filas,
+            )
+        self._contar_escrituras(len(filas))
+
+    def _contar_escrituras(self, cantidad: int):
+        # La compactación corre fuera del hilo que escribe, y nunca dos a la vez
+        with self._lock:
+            self._escrituras += cantidad
+            if self._escrituras < 1000 or self._compactando:
+                return
+            self._escrituras = 0
+            self._compactando = True
+        threading.Thread(target=self._compactar_en_segundo_plano, name="compactar-indicadores", daemon=True).start()
+
+    def _compactar_en_segundo_plano(self):
+        try:
+            self.compactar()
+        except sqlite3.Error as error:
+            metricas.contar("errores_total", operacion="store_compactar")
+            print("No se pudo compactar el almacén local:", error)
+        finally:
+            with self._lock:
+                self._compactando = False
+            self._conexiones.cerrar_hilo()
+
+    def compactar(self) -> int:
+        """
+        Elimina las filas más antiguas por encima de max_rows y devuelve cuántas borró.
+        Sin VACUUM ni checkpoint TRUNCATE, que esperan a los lectores: las páginas
+        liberadas se reutilizan en las inserciones siguientes y el tamaño del archivo
+        queda acotado por max_rows.
+        """
+        conn = self._conexion()
+        (filas,) = conn.execute("SELECT COUNT(*) FROM valores").fetchone()
+        if filas <= self.max_rows:
+            return 0
+        with conn:
+            borradas = conn.execute(
+                "DELETE FROM valores WHERE rowid IN ("
+                "  SELECT rowid FROM valores ORDER BY guardado DESC LIMIT -1 OFFSET ?"
+                ")",
+                (self.max_rows,),
+            ).rowcount
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        return borradas
+
+    def close(self):
+        self._conexiones.close()
+
+
+def _fecha_iso(valor):
+    # "dd-mm-yyyy" / "d-m-yyyy" (formato de la app y de la API) pasa a date; lo demás queda igual
+    if isinstance(valor, str) and not re.match(r"\s*\d{4}-", valor):
+        return datetime.datetime.strptime(valor.strip(), "%d-%m-%Y").date()
+    return valor
+
+
+def _como_dias(fechas) -> np.ndarray:
+    """Fechas (escalar o arreglo de date, datetime64, "yyyy-mm-dd" o "dd-mm-yyyy") como datetime64[D]."""
+    arreglo = np.asarray(fechas)
+    if arreglo.dtype.kind in "USO":
+        arreglo = np.frompyfunc(_fecha_iso, 1, 1)(arreglo)
+    return np.asarray(arreglo, dtype="datetime64[D]")
+
+
+class IndicatorSeries:
+    """
+    Serie de un indicador como dos arreglos NumPy paralelos ordenados por fecha:
+    fechas (datetime64[D]) y valores (float64). Las operaciones son vectorizadas.
+    """
+
+    def __init__(self, indicator: str, fechas, valores):
+        fechas = _como_dias(fechas)
+        valores = np.asarray(valores, dtype=np.float64)
+        orden = np.argsort(fechas, kind="stable")
+        self.indicator = indicator
+        self.fechas = fechas[orden]
+        self.valores = valores[orden]
+
+    @classmethod
+    def from_serie(cls, indicator: str, serie: list) -> "IndicatorSeries":
+        # serie: lista {"fecha": "yyyy-mm-ddT...", "valor": n} tal como la entrega mindicador.cl
+        fechas = np.array([p["fecha"][:10] for p in serie], dtype="datetime64[D]")
+        valores = np.array([p["valor"] for p in serie], dtype=np.float64)
+        return cls(indicator, fechas, valores)
+
+    def __len__(self) -> int:
+        return len(self.fechas)
+
+    def merge(self, otra: "IndicatorSeries") -> "IndicatorSeries":
+        # Ante fechas repetidas gana el valor de `otra` (el más reciente)
+        fechas = np.concatenate([otra.fechas, self.fechas])
+        valores = np.concatenate([otra.valores, self.valores])
+        fechas, primera = np.unique(fechas, return_index=True)
+        return IndicatorSeries(self.indicator, fechas, valores[primera])
+
+    def between(self, start, end) -> "IndicatorSeries":
+        desde = np.searchsorted(self.fechas, np.datetime64(start, "D"), side="left")
+        hasta = np.searchsorted(self.fechas, np.datetime64(end, "D"), side="right")
+        return IndicatorSeries(self.indicator, self.fechas[desde:hasta], self.valores[desde:hasta])
+
+    def value_at(self, fechas) -> np.ndarray:
+        """Último valor publicado en o antes de cada fecha (NaN si no hay ninguno)."""
+        fechas = _como_dias(fechas)
+        idx = np.searchsorted(self.fechas, fechas, side="right") - 1
+        resultado = self.valores[np.clip(idx, 0, None)] if len(self) else np.full(fechas.shape, np.nan)
+        return np.where(idx >= 0, resultado, np.nan)
+
+    def returns(self) -> np.ndarray:
+        return self.valores[1:] / self.valores[:-1] - 1
+
+    def log_returns(self) -> np.ndarray:
+        return np.diff(np.log(self.valores))
+
+    def moving_average(self, ventana: int) -> np.ndarray:
+        acumulado = np.cumsum(np.insert(self.valores, 0, 0.0))
+        return (acumulado[ventana:] - acumulado[:-ventana]) / ventana
+
+    def rolling_min(self, ventana: int) -> np.ndarray:
+        return np.lib.stride_tricks.sliding_window_view(self.valores, ventana).min(axis=1)
+
+    def rolling_max(self, ventana: int) -> np.ndarray:
+        return np.lib.stride_tricks.sliding_window_view(self.valores, ventana).max(axis=1)
+
+
+class SeriesStore:
+    """
+    Series completas por indicador, alimentadas por Finance.fetch_range (y por las
+    consultas de un día si Finance se creó con series_en_consultas=True). Permite convertir montos entre indicadores expresados en pesos
+    (p. ej. USD -> CLP -> UF) de forma vectorizada; "clp" vale 1 en cualquier fecha.
+    """
+
+    EN_PESOS = {"uf", "dolar", "euro", "utm", "ivp"}
+
+    def __init__(self):
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def add(self, indicator: str, fechas, valores):
+        indicator = indicator.strip().lower()
+        nueva = IndicatorSeries(indicator, fechas, valores)
+        with self._lock:
+            actual = self._series.get(indicator)
+            self._series[indicator] = nueva if actual is None else actual.merge(nueva)
+
+    def add_serie(self, indicator: str, serie: list):
+        nueva = IndicatorSeries.from_serie(indicator, serie)
+        self.add(indicator, nueva.fechas, nueva.valores)
+
+    def get(self, indicator: str) -> Optional[IndicatorSeries]:
+        with self._lock:
+            return self._series.get(indicator.strip().lower())
+
+    @staticmethod
+    def tasas(indicator: str, forma: Tuple[int, ...], buscar) -> np.ndarray:
+        """
+        Reglas comunes de conversión a pesos (también las usa ConversionService): "clp"
+        vale 1, los indicadores de EN_PESOS se obtienen con buscar(indicador) y el resto
+        no es convertible.
+        """
+        indicator = indicator.strip().lower()
+        if indicator == "clp":
+            return np.ones(forma)
+        if indicator not in SeriesStore.EN_PESOS:
+            raise ValueError(f"{indicator} no es convertible a pesos")
+        return buscar(indicator)
+
+    def rate(self, indicator: str, fechas) -> np.ndarray:
+        """Pesos chilenos por unidad del indicador en cada fecha."""
+        fechas = _como_dias(fechas)
+
+        def buscar(indicator: str) -> np.ndarray:
+            serie = self.get(indicator)
+            if serie is None:
+                raise KeyError(f"No hay datos cargados para {indicator}")
+            return serie.value_at(fechas)
+
+        return self.tasas(indicator, fechas.shape, buscar)
+
+    def convert(self, montos, desde: str, hasta: str, fechas) -> np.ndarray:
+        return np.asarray(montos, dtype=np.float64) * self.rate(desde, fechas) / self.rate(hasta, fechas)
+
+
 class Finance:
-    def __init__(self, base_url: str = "https://mindicador.cl/api"):
+    def __init__(
+        self,
+        base_url: str = "https://mindicador.cl/api",
+        cache: Optional[IndicatorCache] = None,
+        store: Optional[IndicatorStore] = None,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 10,
+        reintentos: int = 3,
+        backoff: float = 0.5,
+        backoff_max: float = 8.0,
+        pool_size: int = 10,
+        series_en_consultas: bool = False,
+    ):
+        """
+        Las solicitudes usan una sesión HTTP persistente (keep-alive, hasta pool_size
+        conexiones reutilizables). Los errores 5xx, timeouts y fallos de conexión se
+        reintentan hasta `reintentos` veces con espera exponencial con jitter:
+        uniforme entre 0 y min(backoff_max, backoff * 2**intento) segundos.
+        `series` (NumPy) se llena con fetch_range; con series_en_consultas=True también
+        con cada consulta de un día, a costa de importar NumPy en la primera consulta.
+        """
         self.base_url = base_url
+        self.cache = cache if cache is not None else IndicatorCache()
+        self.store = store
+        self.series = SeriesStore()
+        self.series_en_consultas = series_en_consultas
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.reintentos = reintentos
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self._en_vuelo = SingleFlight()
+        self.session = requests.Session()
+        adaptador = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adaptador)
+        self.session.mount("http://", adaptador)
+
+    def close(self):
+        self.session.close()
+
+    def _get(self, url: str, read_timeout: Optional[float] = None) -> "requests.Response":
+        timeout = (self.connect_timeout, read_timeout or self.read_timeout)
+        intento = 0
+        while True:
+            try:
+                with metricas.medir("http_fetch"):
+                    respuesta = self.session.get(url, timeout=timeout)
+                if respuesta.status_code < 500:
+                    return respuesta
+                metricas.contar("errores_total", operacion="http", tipo=str(respuesta.status_code))
+                if intento >= self.reintentos:
+                    respuesta.raise_for_status()
+            except (requests.Timeout, requests.ConnectionError) as error:
+                metricas.contar("errores_total", operacion="http", tipo=type(error).__name__)
+                if intento >= self.reintentos:
+                    raise
+            metricas.contar("reintentos_total")
+            time.sleep(random.uniform(0, min(self.backoff_max, self.backoff * 2 ** intento)))
+            intento += 1
+
+    def _buscar_local(self, clave: Tuple[str, datetime.date]) -> Optional[dict]:
+        en_cache = self.cache.get(clave)
+        if en_cache is not None:
+            return en_cache
+        if self.store is not None:
+            try:
+                guardado = self.store.get(clave)
+            except sqlite3.Error as error:
+                # Sin almacén local se sigue a la API
+                self._error_store(error)
+                return None
+            metricas.contar("store_total", resultado="hit" if guardado is not None else "miss")
+            if guardado is not None:
+                self.cache.put(clave, guardado)
+                return guardado
+        return None
+
+    def _guardar_local(self, clave: Tuple[str, datetime.date], resultado: dict):
+        self.cache.put(clave, resultado)
+        if self.store is not None:
+            try:
+                self.store.put(clave, resultado)
+            except sqlite3.Error as error:
+                # El valor ya se descargó: un almacén bloqueado no debe perderlo
+                self._error_store(error)
+
+    @staticmethod
+    def _error_store(error: Exception):
+        metricas.contar("errores_total", operacion="store")
+        print("Error del almacén local:", error)
+
+    def _consultar_api(self, indicator: str, fecha: str, read_timeout: Optional[float] = None) -> dict:
+        # Lanza la excepción original (red, HTTP, JSON) o IndicadorSinDatos si la serie viene vacía
+        url = f"{self.base_url}/{indicator}/{fecha}"
+        respuesta = self._get(url, read_timeout)
+        with metricas.medir("json_parse"):
+            data = respuesta.json()
+        serie = data.get("serie", [])
+        if not serie:
+            raise IndicadorSinDatos(f"No hay datos de {indicator} para {fecha}")
+        if self.series_en_consultas:
+            self.series.add_serie(indicator, serie)
+        # Primer elemento: valor y fecha
+        return {
+            "value": float(serie[0]["valor"]),
+            "indicator_date": datetime.datetime.strptime(serie[0]["fecha"][:10], "%Y-%m-%d").date(),
+            "source": self.base_url
+        }
+
+    def _descargar(
+        self,
+        indicator: str,
+        fecha: str,
+        clave: Optional[Tuple[str, datetime.date]],
+        read_timeout: Optional[float] = None,
+    ) -> dict:
+        # Solicitudes simultáneas de la misma (indicador, fecha) comparten una sola descarga
+        def tarea():
+            resultado = self._consultar_api(indicator, fecha, read_timeout)
+            if clave is not None:
+                self._guardar_local(clave, resultado)
+            return resultado
+
+        resultado = self._en_vuelo.do(clave if clave is not None else (indicator, fecha), tarea)
+        return dict(resultado)
 
     def _fetch_indicator(self, indicator: str, fecha: Optional[str] = None) -> Optional[dict]:
         # fecha formato dd-mm-yyyy (API permite /indicador y /indicador/dd-mm-yyyy)
         if not fecha:
             fecha = hoy_dd_mm_yyyy()
         try:
-            url = f"{self.base_url}/{indicator}/{fecha}"
-            respuesta = requests.get(url, timeout=10)
-            data = respuesta.json()
-            serie = data.get("serie", [])
-            if not serie:
-                print("No hay datos para la fecha solicitada.")
-                return None
-            # Primer elemento: valor y fecha
-            return {
-                "value": float(serie[0]["valor"]),
-                "indicator_date": datetime.datetime.strptime(serie[0]["fecha"][:10], "%Y-%m-%d").date(),
-                "source": self.base_url
-            }
-        except Exception:
-            print("Hubo un error con la solicitud")
+            clave = self.cache.clave(indicator, fecha)
+        except ValueError:
+            clave = None
+        if clave is not None:
+            local = self._buscar_local(clave)
+            if local is not None:
+                return local
+        try:
+            return self._descargar(indicator, fecha, clave)
+        except IndicadorSinDatos:
+            metricas.contar("sin_datos_total", indicador=indicator)
+            print("No hay datos para la fecha solicitada.")
+            return None
+        except Exception as error:
+            metricas.contar("errores_total", operacion="fetch_indicator", tipo=type(error).__name__)
+            print("Hubo un error con la solicitud:", error)
             return None
 
+    @staticmethod
+    def _como_fecha(fecha: Union[str, datetime.date]) -> datetime.date:
+        if isinstance(fecha, datetime.datetime):
+            return fecha.date()
+        if isinstance(fecha, datetime.date):
+            return fecha
+        return datetime.datetime.strptime(fecha.strip(), "%d-%m-%Y").date()
+
+    def fetch_range(
+        self,
+        indicator: str,
+        start: Union[str, datetime.date],
+        end: Union[str, datetime.date],
+    ) -> Optional[dict]:
+        """
+        Descarga el rango [start, end] usando /api/{indicador}/{yyyy}: una solicitud por
+        año en lugar de una por día. Devuelve columnas ordenadas por fecha:
+        {"indicator", "dates": [datetime.date], "values": array("d"), "source"}.
+        Cada punto también queda en la caché y en el almacén local.
+        """
+        indicator = indicator.strip().lower()
+        inicio = self._como_fecha(start)
+        fin = self._como_fecha(end)
+        if inicio > fin:
+            inicio, fin = fin, inicio
+
+        puntos = {}
+        for anio in range(inicio.year, fin.year + 1):
+            try:
+                url = f"{self.base_url}/{indicator}/{anio}"
+                respuesta = self._get(url)
+                with metricas.medir("json_parse"):
+                    serie = respuesta.json().get("serie", [])
+            except Exception:
+                print(f"Hubo un error con la solicitud del año {anio}")
+                return None
+            for punto in serie:
+                fecha = datetime.date.fromisoformat(punto["fecha"][:10])
+                if inicio <= fecha <= fin:
+                    puntos[fecha] = float(punto["valor"])
+
+        fechas = sorted(puntos)
+        valores = array("d", (puntos[f] for f in fechas))
+        items = [
+            ((indicator, f), {"value": v, "indicator_date": f, "source": self.base_url})
+            for f, v in zip(fechas, valores)
+        ]
+        for clave, valor in items:
+            self.cache.put(clave, valor)
+        if self.store is not None:
+            try:
+                self.store.put_many(items)
+            except sqlite3.Error as error:
+                self._error_store(error)
+        if fechas:
+            self.series.add(indicator, fechas, valores)
+        return {"indicator": indicator, "dates": fechas, "values": valores, "source": self.base_url}
+
+    @staticmethod
+    def _fila_historial(usuario: str, indicador: str, datos: dict) -> dict:
+        return {
+            "usr": usuario,
+            "ind": indicador,
+            "val": float(datos["valor"]),
+            "f_ind": datos["fecha_indicador"],
+            "f_cons": datetime.date.today(),
+            "src": datos["fuente"],
+        }
+
     def guardar_consulta(self, db, usuario: str, indicador: str, datos: dict) -> dict:
         """
         Guarda la consulta en la tabla 'historial_consultas' que usa la UI Flet.
         Espera que 'datos' tenga: valor (float), fuente (str), fecha_indicador (datetime.date)
         """
         try:
-            db.query(
-                sql="""
-                    INSERT INTO historial_consultas(
-                        usuario, indicador, valor, fecha_indicador, fecha_consulta, fuente
-                    )
-                    VALUES (:usr, :ind, :val, :f_ind, :f_cons, :src)
-                """,
-                parameters={
-                    "usr": usuario,
-                    "ind": indicador,
-                    "val": float(datos["valor"]),
-                    "f_ind": datos["fecha_indicador"],           
-                    "f_cons": datetime.date.today(),
-                    "src": datos["fuente"],
-                },
-            )
+            if db.execute("insertar_historial", self._fila_historial(usuario, indicador, datos)) is None:
+                return {"success": False, "message": "Error al guardar consulta"}
             return {"success": True, "message": "Consulta guardada"}
         except Exception as ex:
             return {"success": False, "message": f"Error al guardar consulta: {ex}"}
 
+    def guardar_consultas(self, db: Database, consultas: Iterable[Tuple[str, str, dict]]) -> dict:
+        """
+        Versión por lotes de guardar_consulta: recibe tuplas (usuario, indicador, datos)
+        y las inserta todas con un solo executemany y un solo commit.
+        """
+        try:
+            filas = [self._fila_historial(usuario, indicador, datos) for usuario, indicador, datos in consultas]
+            if db.query_many("insertar_historial", filas) is None:
+                return {"success": False, "message": "Error al guardar consultas"}
+            return {"success": True, "message": f"{len(filas)} consultas guardadas"}
+        except Exception as ex:
+            return {"success": False, "message": f"Error al guardar consultas: {ex}"}
+
+    def historial_writer(self, db: Database, max_filas: int = 500, max_edad: float = 5.0) -> BufferedWriter:
+        """Writer con buffer para historial_consultas; agregar filas con Finance._fila_historial(...)."""
+        return BufferedWriter(db, "insertar_historial", max_filas=max_filas, max_edad=max_edad)
+
     def consultar_y_opcionalmente_guardar(self, db: Database, username: str, indicador: str, fecha: Optional[str] = None):
         data = self._fetch_indicator(indicador, fecha)
         if not data:
@@ -178,7 +1814,7 @@ class Finance:
         print(f"{indicador.upper()} al {data['indicator_date']}: {data['value']}")
         guardar = input("¿Desea registrar esta consulta en la base de datos? (s/n): ").strip().lower()
         if guardar == "s":
-            self._registrar_consulta(
+            registrada = self._registrar_consulta(
                 db=db,
                 username=username,
                 indicator_name=indicador,
@@ -186,28 +1822,31 @@ class Finance:
                 indicator_date=data["indicator_date"],
                 source=data["source"]
             )
-            print("Consulta registrada.")
+            print("Consulta registrada." if registrada is not None else "No se pudo registrar la consulta.")
         else:
             print("Consulta no registrada.")
 
-    def _registrar_consulta(self, db: Database, username: str, indicator_name: str, indicator_value: float, indicator_date: datetime.date, source: str):
-        query_date = datetime.date.today()
-        db.query(
-            sql="""
-                INSERT INTO indicator_log(
-                    indicator_name, indicator_value, indicator_date, query_date, username, source
-                ) VALUES (:name, :value, :ind_date, :qry_date, :username, :source)
-            """,
-            parameters={
-                "name": indicator_name,
-                "value": indicator_value,
-                "ind_date": indicator_date,
-                "qry_date": query_date,
-                "username": username,
-                "source": source
-            }
+    @staticmethod
+    def _fila_indicator_log(username: str, indicator_name: str, indicator_value: float, indicator_date: datetime.date, source: str) -> dict:
+        return {
+            "name": indicator_name,
+            "value": indicator_value,
+            "ind_date": indicator_date,
+            "qry_date": datetime.date.today(),
+            "username": username,
+            "source": source
+        }
+
+    def _registrar_consulta(self, db: Database, username: str, indicator_name: str, indicator_value: float, indicator_date: datetime.date, source: str) -> Optional[int]:
+        return db.execute(
+            "insertar_indicator_log",
+            self._fila_indicator_log(username, indicator_name, indicator_value, indicator_date, source)
         )
 
+    def _registrar_consultas(self, db: Database, registros: Iterable[dict]) -> Optional[int]:
+        # Cada registro usa los mismos nombres que los argumentos de _registrar_consulta
+        return db.query_many("insertar_indicator_log", [self._fila_indicator_log(**r) for r in registros])
+
     def get_usd(self, db: Database, username: str, fecha: Optional[str] = None):
         self.consultar_y_opcionalmente_guardar(db, username, "dolar", fecha)
 
@@ -226,6 +1865,241 @@ class Finance:
     def get_utm(self, db: Database, username: str, fecha: Optional[str] = None):
         self.consultar_y_opcionalmente_guardar(db, username, "utm", fecha)
 
+class ConversionService:
+    """
+    Conversión de montos entre pesos y los indicadores en pesos (uf, dolar, euro, utm,
+    ivp) usando tablas diarias precalculadas: una fila por indicador de INDICADORES y
+    una columna por día de [start, end], rellenando fines de semana y feriados con el
+    último valor publicado. Cada conversión es un acceso por índice, sin HTTP.
+    ipc es una variación porcentual: se carga en la tabla pero no es convertible.
+    """
+
+    def __init__(self, finance: Finance, start: Union[str, datetime.date], end: Union[str, datetime.date, None] = None):
+        self.finance = finance
+        self.start = Finance._como_fecha(start)
+        self.end = Finance._como_fecha(end) if end is not None else datetime.date.today()
+        self._fila = {ind: i for i, ind in enumerate(INDICADORES)}
+        self.refresh()
+
+    def refresh(self):
+        """Vuelve a descargar (un request por indicador y año) y recalcula las tablas."""
+        for indicador in INDICADORES:
+            self.finance.fetch_range(indicador, self.start, self.end)
+        self.fechas = np.arange(np.datetime64(self.start, "D"), np.datetime64(self.end, "D") + 1)
+        tabla = np.full((len(INDICADORES), len(self.fechas)), np.nan)
+        for indicador, fila in self._fila.items():
+            serie = self.finance.series.get(indicador)
+            if serie is not None:
+                tabla[fila] = serie.value_at(self.fechas)
+        self.tabla = tabla
+
+    def _indices(self, fechas) -> np.ndarray:
+        fechas = _como_dias(fechas)
+        idx = (fechas - self.fechas[0]).astype(np.int64)
+        if np.any((idx < 0) | (idx >= len(self.fechas))):
+            raise ValueError(f"Fecha fuera del rango precalculado {self.start} - {self.end}")
+        return idx
+
+    def _tasas(self, indicador: str, idx: np.ndarray) -> np.ndarray:
+        return SeriesStore.tasas(indicador, idx.shape, lambda ind: self.tabla[self._fila[ind], idx])
+
+    def convert_many(self, montos, desde: str, hasta: str, fechas) -> np.ndarray:
+        """Convierte arreglos de montos y fechas (del mismo largo o escalares); NaN si no hay tasa."""
+        idx = self._indices(fechas)
+        return np.asarray(montos, dtype=np.float64) * self._tasas(desde, idx) / self._tasas(hasta, idx)
+
+    def convert(self, monto: float, desde: str, hasta: str, fecha: Union[str, datetime.date]) -> float:
+        fecha = Finance._como_fecha(fecha)
+        return float(self.convert_many(monto, desde, hasta, np.datetime64(fecha, "D")))
+
+
+class PrefetchScheduler:
+    """
+    Hilo en segundo plano que, a las horas indicadas (HH:MM, hora local), vuelve a
+    descargar el valor del día de cada indicador para dejar la caché y el almacén
+    local calientes antes de que llegue el primer usuario. La fecha y hora de la
+    última ejecución completa se guarda en `estado`; al arrancar se recuperan los días
+    perdidos con fetch_range (un request por año) y se refresca hoy si desde entonces
+    pasó alguna hora programada o si la caché no tiene el valor del día (reinicio).
+    """
+
+    def __init__(
+        self,
+        finance: Finance,
+        horas: Iterable[str] = ("09:05",),
+        indicadores: Iterable[str] = INDICADORES,
+        estado: str = "prefetch_estado.json",
+    ):
+        self.finance = finance
+        self.horas = sorted(datetime.datetime.strptime(h, "%H:%M").time() for h in horas)
+        self.indicadores = tuple(indicadores)
+        self.estado = estado
+        self.ejecuciones = 0
+        self.ejecuciones_perdidas = 0
+        self.errores = 0
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def _leer_ultima(self) -> Optional[datetime.datetime]:
+        # Un estado antiguo con solo la fecha se lee como la medianoche de ese día
+        try:
+            with open(self.estado, encoding="UTF-8") as archivo:
+                return datetime.datetime.fromisoformat(json.load(archivo)["ultima_ejecucion"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _guardar_ultima(self, momento: datetime.datetime):
+        with open(self.estado, "w", encoding="UTF-8") as archivo:
+            json.dump({"ultima_ejecucion": momento.isoformat(timespec="seconds")}, archivo)
+
+    def _cache_fria(self) -> bool:
+        hoy = hoy_dd_mm_yyyy()
+        return any(self.finance.cache.clave(i, hoy) not in self.finance.cache for i in self.indicadores)
+
+    def proxima_ejecucion(self, ahora: datetime.datetime) -> datetime.datetime:
+        for hora in self.horas:
+            candidata = datetime.datetime.combine(ahora.date(), hora)
+            if candidata > ahora:
+                return candidata
+        return datetime.datetime.combine(ahora.date() + datetime.timedelta(days=1), self.horas[0])
+
+    def ejecutar(self):
+        """
+        Refresca el día de hoy para todos los indicadores (ignora la caché). Los valores
+        descargados quedan en caché hasta la próxima ejecución programada y no solo
+        ttl_hoy segundos, que dejaría la caché fría casi todo el día.
+        """
+        hoy = hoy_dd_mm_yyyy()
+        ahora = datetime.datetime.now()
+        vigencia = (self.proxima_ejecucion(ahora) - ahora).total_seconds()
+        fallos = 0
+        for indicador in self.indicadores:
+            clave = self.finance.cache.clave(indicador, hoy)
+            try:
+                resultado = self.finance._descargar(indicador, hoy, clave)
+                self.finance.cache.put(clave, resultado, ttl=vigencia)
+            except Exception as error:
+                fallos += 1
+                print(f"Prefetch de {indicador} falló: {error}")
+        self.ejecuciones += 1
+        self.errores += fallos
+        if not fallos:
+            self._guardar_ultima(ahora)
+
+    def recuperar(self):
+        """
+        Cuenta las ejecuciones programadas que no ocurrieron desde la última completa,
+        descarga de una vez los días anteriores perdidos y refresca hoy si corresponde.
+        """
+        ultima = self._leer_ultima()
+        ahora = datetime.datetime.now()
+        hoy = ahora.date()
+        pendiente = ultima is None
+        if ultima is not None:
+            programada = self.proxima_ejecucion(ultima)
+            while programada <= ahora:
+                self.ejecuciones_perdidas += 1
+                pendiente = True
+                programada = self.proxima_ejecucion(programada)
+            if ultima.date() < hoy - datetime.timedelta(days=1):
+                for indicador in self.indicadores:
+                    self.finance.fetch_range(indicador, ultima.date() + datetime.timedelta(days=1), hoy - datetime.timedelta(days=1))
+        # Antes de la primera hora del día no hay nada que refrescar todavía
+        if ahora >= datetime.datetime.combine(hoy, self.horas[0]) and (pendiente or self._cache_fria()):
+            self.ejecutar()
+
+    def _bucle(self):
+        self.recuperar()
+        while not self._detener.is_set():
+            espera = (self.proxima_ejecucion(datetime.datetime.now()) - datetime.datetime.now()).total_seconds()
+            if self._detener.wait(max(espera, 0)):
+                break
+            self.ejecutar()
+
+    def start(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="prefetch-indicadores", daemon=True)
+            self._hilo.start()
+
+    def stop(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+
+
+class AsyncFinance:
+    """
+    Contraparte asyncio de Finance para consultar muchos pares (indicador, fecha) a la
+    vez. Reutiliza la caché y el almacén del Finance envuelto; las descargas corren en
+    hilos (requests es bloqueante) limitadas por max_concurrencia, y cada una tiene su
+    propio plazo de timeout segundos. Las descargas usan un pool de hilos propio de
+    max_concurrencia hilos (no el executor por defecto del loop, que es compartido y
+    tiene su propio tope). Un hilo no se puede interrumpir: al vencer el plazo la
+    consulta falla, pero su cupo sigue ocupado hasta que la descarga termina.
+    """
+
+    def __init__(self, finance: Optional[Finance] = None, max_concurrencia: int = 6, timeout: float = 10.0):
+        self.finance = finance if finance is not None else Finance()
+        self.max_concurrencia = max_concurrencia
+        self.timeout = timeout
+        self._ejecutor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrencia, thread_name_prefix="async-finance"
+        )
+
+    def close(self):
+        self._ejecutor.shutdown(wait=False, cancel_futures=True)
+
+    async def fetch(self, indicator: str, fecha: Optional[str] = None) -> dict:
+        return await self._fetch(indicator, fecha, asyncio.Semaphore(1))
+
+    async def _fetch(self, indicator: str, fecha: Optional[str], semaforo: asyncio.Semaphore) -> dict:
+        if not fecha:
+            fecha = hoy_dd_mm_yyyy()
+        clave = self.finance.cache.clave(indicator, fecha)
+        local = self.finance._buscar_local(clave)
+        if local is not None:
+            return local
+        await semaforo.acquire()
+        try:
+            descarga = asyncio.get_running_loop().run_in_executor(
+                self._ejecutor, self.finance._descargar, clave[0], fecha, clave, self.timeout
+            )
+        except BaseException:
+            semaforo.release()
+            raise
+
+        def liberar(tarea: asyncio.Future):
+            semaforo.release()
+            if not tarea.cancelled():
+                tarea.exception()  # ya informada a quien esperaba, o descartada tras el timeout
+
+        descarga.add_done_callback(liberar)
+        # shield: el timeout deja de esperar, pero el cupo se libera al terminar el hilo
+        return await asyncio.wait_for(asyncio.shield(descarga), timeout=self.timeout)
+
+    async def fetch_many(self, pares: Iterable[Tuple[str, Optional[str]]]) -> dict:
+        """
+        Devuelve {"resultados": {(indicador, fecha): dict}, "errores": {(indicador, fecha): str}}.
+        Un par que falla o vence su plazo no interrumpe a los demás.
+        """
+        pares = list(pares)
+        semaforo = asyncio.Semaphore(self.max_concurrencia)
+        respuestas = await asyncio.gather(
+            *(self._fetch(ind, fecha, semaforo) for ind, fecha in pares),
+            return_exceptions=True,
+        )
+        resultados, errores = {}, {}
+        for par, respuesta in zip(pares, respuestas):
+            if isinstance(respuesta, asyncio.TimeoutError):
+                errores[par] = f"Tiempo de espera agotado ({self.timeout} s)"
+            elif isinstance(respuesta, Exception):
+                errores[par] = str(respuesta) or type(respuesta).__name__
+            else:
+                resultados[par] = respuesta
+        return {"resultados": resultados, "errores": errores}
+
+
 # -----------------------------
 # Menús
 # -----------------------------
@@ -259,11 +2133,73 @@ def menu_indicadores():
         """
     )
 
+def sesion_indicadores(db: Database, fin: Finance, usuario: str):
+    while True:
+        menu_indicadores()
+        op = input("Seleccione indicador: ").strip()
+
+        if op == "1":
+            fin.get_uf(db, usuario)
+        elif op == "2":
+            fin.get_usd(db, usuario)
+        elif op == "3":
+            fin.get_eur(db, usuario)
+        elif op == "4":
+            fin.get_ivp(db, usuario)
+        elif op == "5":
+            fin.get_ipc(db, usuario)
+        elif op == "6":
+            fin.get_utm(db, usuario)
+        elif op == "7":
+            break
+        else:
+            print("Opción no válida")
+
+def en_segundo_plano(funcion) -> Future:
+    """Ejecuta funcion() en un hilo daemon; el Future entrega su resultado o su excepción."""
+    futuro = Future()
+
+    def ejecutar():
+        try:
+            futuro.set_result(funcion())
+        except BaseException as error:
+            futuro.set_exception(error)
+
+    threading.Thread(target=ejecutar, daemon=True).start()
+    return futuro
+
+
+def _preparar_servicios() -> Tuple[Database, Finance]:
+    db = database_desde_env()
+    db.migrate()
+    arranque.marcar("base de datos lista")
+    fin = Finance(store=IndicatorStore(
+        path=os.getenv("INDICADORES_STORE", "indicadores.sqlite3"),
+        max_rows=int(os.getenv("INDICADORES_STORE_MAX", "100000")),
+    ))
+    arranque.marcar("finanzas lista")
+    return db, fin
+
+
 if __name__ == "__main__":
-    db = Database(username=username, password=password, dsn=dsn)
-    fin = Finance()
-    db.create_all_tables()
+    import sys
+
+    if "--tiempos" in sys.argv or os.getenv("ECOTECH_TIEMPOS"):
+        arranque.activar()
+    if os.getenv("METRICAS_PUERTO"):
+        metricas.servir(int(os.getenv("METRICAS_PUERTO")))
+    Auth.hasher = BcryptPool(
+        rounds=int(os.getenv("BCRYPT_ROUNDS", "12")),
+        workers=int(os.getenv("BCRYPT_WORKERS", "0")) or None,
+        max_pendientes=int(os.getenv("BCRYPT_MAX_PENDIENTES", "64")),
+    )
+    # La conexión, las migraciones y la importación de oracledb/requests avanzan
+    # mientras el usuario lee el menú; servicios.result() espera solo si aún no terminan
+    servicios = en_segundo_plano(_preparar_servicios)
 
+    # El CLI no guarda la sesión en disco: en un kiosco, un token que sobreviva al
+    # proceso (terminal cerrada, kill) dejaría entrar al siguiente sin contraseña
+    arranque.marcar("menú principal")
     while True:
         menu_principal()
         opcion = input("Seleccione una opción: ").strip()
@@ -272,38 +2208,29 @@ if __name__ == "__main__":
             usuario = input("Usuario: ").strip()
             contrasenia = input("Contraseña: ").strip()
 
-            if Auth.login(db, usuario, contrasenia):
+            db, fin = servicios.result()
+            estado = Auth.login(db, usuario, contrasenia)
+            if estado["success"]:
                 print("Bienvenido", usuario)
-                while True:
-                    menu_indicadores()
-                    op = input("Seleccione indicador: ").strip()
-
-                    if op == "1":
-                        fin.get_uf(db, usuario)
-                    elif op == "2":
-                        fin.get_usd(db, usuario)
-                    elif op == "3":
-                        fin.get_eur(db, usuario)
-                    elif op == "4":
-                        fin.get_ivp(db, usuario)
-                    elif op == "5":
-                        fin.get_ipc(db, usuario)
-                    elif op == "6":
-                        fin.get_utm(db, usuario)
-                    elif op == "7":
-                        break
-                    else:
-                        print("Opción no válida")
+                try:
+                    sesion_indicadores(db, fin, usuario)
+                finally:
+                    # "Volver", Ctrl+C o fin de la entrada cierran la sesión
+                    Auth.sesiones.revoke(estado["token"])
             else:
-                print("Usuario o contraseña incorrectos")
+                print(estado["message"])
 
         elif opcion == "2":
             nuevo_usuario = input("Nuevo usuario: ").strip()
             nueva_contrasenia = input("Nueva contraseña: ").strip()
-            Auth.register(db, nuevo_usuario, nueva_contrasenia)
+            db, fin = servicios.result()
+            print(Auth.register(db, nuevo_usuario, nueva_contrasenia)["message"])
 
         elif opcion == "3":
             print("Saliendo del sistema...")
+            if servicios.done() and servicios.exception() is None:
+                servicios.result()[0].close()
+            Auth.hasher.close()
             break
         else:
             print("Opción inválida")
\ No newline at end of file
@@ -3,8 +3,9 @@ import requests
 import oracledb
 import os
 import re
+import threading
 from dotenv import load_dotenv
-from typing import Optional, Tuple
+from typing import Iterator, Optional, Tuple
 import datetime
 
 load_dotenv()
@@ -14,10 +15,17 @@ load_dotenv()
 # Database access layer (Oracle)
 # ------------------------------
 class Database:
+    # Each sequence hands out a block of ID_BLOCK_SIZE ids per NEXTVAL (INCREMENT BY),
+    # so next_id only goes to the database once every ID_BLOCK_SIZE inserts.
+    ID_BLOCK_SIZE = 20
+    SEQUENCES = {"USERS": "USERS_SEQ", "INDICATOR_LOGS": "INDICATOR_LOGS_SEQ"}
+
     def __init__(self, username: str, dsn: str, password: str):
         self.username = username
         self.dsn = dsn
         self.password = password
+        self._id_blocks = {}
+        self._id_lock = threading.Lock()
 
     def get_connection(self):
         return oracledb.connect(user=self.username, password=self.password, dsn=self.dsn)
@@ -41,6 +49,11 @@ class Database:
                 "  username VARCHAR2(32) NOT NULL,"
                 "  provider VARCHAR2(128) NOT NULL"
                 ")"
+            ),
+            # Index for keyset pagination in fetch_history
+            (
+                "CREATE INDEX INDICATOR_LOGS_USER_DATE_IX "
+                "ON INDICATOR_LOGS (username, query_date, id)"
             )
         ]
         for ddl in tables:
@@ -50,6 +63,16 @@ class Database:
                 # If table exists, Oracle will raise an error; we can ignore for idempotency
                 pass
 
+        for table, sequence in self.SEQUENCES.items():
+            try:
+                # Start above any id assigned by the old MAX(id)+1 scheme
+                rows = self.query(f"SELECT NVL(MAX(id), 0) FROM {table}")
+                start = int(rows[0][0]) + 1
+                self.query(f"CREATE SEQUENCE {sequence} START WITH {start} INCREMENT BY {self.ID_BLOCK_SIZE}")
+            except Exception:
+                # Sequence already exists
+                pass
+
     def query(self, sql: str, parameters: Optional[dict] = None):
         with self.get_connection() as conn:
             with conn.cursor() as cur:
@@ -58,10 +81,56 @@ class Database:
                     return ejecucion.fetchall()
             conn.commit()
 
+    def stream(self, sql: str, parameters: Optional[dict] = None, arraysize: int = 1000, prefetchrows: int = 1000) -> Iterator[tuple]:
+        """
+        Yields the rows of a SELECT in batches of `arraysize` (with `prefetchrows`
+        sent back on execute) instead of materializing them with fetchall(), so
+        large tables such as INDICATOR_LOGS can be exported in constant memory.
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.arraysize = arraysize
+                cur.prefetchrows = prefetchrows
+                cur.execute(sql, parameters or {})
+                while True:
+                    rows = cur.fetchmany()
+                    if not rows:
+                        break
+                    yield from rows
+
+    def fetch_history(self, user: str, after_cursor: Optional[Tuple[datetime.datetime, int]] = None, page_size: int = 20) -> dict:
+        """
+        Returns one page of INDICATOR_LOGS for the user, newest first:
+        {"rows": [(indicator_name, indicator_value, indicator_date, query_date, provider)],
+         "next_cursor": (query_date, id) to pass as after_cursor, or None on the last page}.
+        """
+        params = {"username": user, "n": page_size + 1}
+        keyset = ""
+        if after_cursor is not None:
+            keyset = " AND (query_date < :cur_date OR (query_date = :cur_date AND id < :cur_id))"
+            params["cur_date"], params["cur_id"] = after_cursor
+        rows = self.query(
+            "SELECT indicator_name, indicator_value, indicator_date, query_date, provider, id "
+            "FROM INDICATOR_LOGS WHERE username = :username" + keyset +
+            " ORDER BY query_date DESC, id DESC FETCH FIRST :n ROWS ONLY",
+            params
+        )
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        return {
+            "rows": [row[:5] for row in rows],
+            "next_cursor": (rows[-1][3], rows[-1][5]) if has_more else None
+        }
+
     def next_id(self, table: str) -> int:
-        rows = self.query(f"SELECT NVL(MAX(id), 0) FROM {table}")
-        current = rows[0][0] if rows else 0
-        return int(current) + 1
+        with self._id_lock:
+            next_value, limit = self._id_blocks.get(table, (0, 0))
+            if next_value >= limit:
+                rows = self.query(f"SELECT {self.SEQUENCES[table]}.NEXTVAL FROM dual")
+                next_value = int(rows[0][0])
+                limit = next_value + self.ID_BLOCK_SIZE
+            self._id_blocks[table] = (next_value + 1, limit)
+            return next_value
 
 
 # ------------------------------
@@ -213,10 +282,11 @@ class Finance:
 # Application session and logging
 # ------------------------------
 class AppSession:
-    def __init__(self, db: Database, finance: Finance, provider: str = "https://mindicador.cl/api"):
+    def __init__(self, db: Database, finance: Finance, provider: str = "https://mindicador.cl/api", page_size: int = 20):
         self.db = db
         self.finance = finance
         self.provider = provider
+        self.page_size = page_size
         self.current_user: Optional[str] = None
 
     def is_logged_in(self) -> bool:
@@ -276,19 +346,22 @@ class AppSession:
             print("Debe iniciar sesión para ver sus registros.")
             return
 
-        rows = self.db.query(
-            "SELECT indicator_name, indicator_value, indicator_date, query_date, provider "
-            "FROM INDICATOR_LOGS WHERE username = :username ORDER BY query_date DESC",
-            {"username": self.current_user}
-        )
-        if not rows:
+        page = self.db.fetch_history(self.current_user, page_size=self.page_size)
+        if not page["rows"]:
             print("No hay registros.")
             return
 
-        for name, value, indicator_date, query_date, provider in rows:
-            ind_date_str = indicator_date.strftime("%d-%m-%Y") if isinstance(indicator_date, datetime.datetime) else str(indicator_date)
-            q_date_str = query_date.strftime("%d-%m-%Y %H:%M:%S") if isinstance(query_date, datetime.datetime) else str(query_date)
-            print(f"{name.upper()} | Valor: {value} | Fecha valor: {ind_date_str} | Consultado: {q_date_str} | Fuente: {provider}")
+        while True:
+            for name, value, indicator_date, query_date, provider in page["rows"]:
+                ind_date_str = indicator_date.strftime("%d-%m-%Y") if isinstance(indicator_date, datetime.datetime) else str(indicator_date)
+                q_date_str = query_date.strftime("%d-%m-%Y %H:%M:%S") if isinstance(query_date, datetime.datetime) else str(query_date)
+                print(f"{name.upper()} | Valor: {value} | Fecha valor: {ind_date_str} | Consultado: {q_date_str} | Fuente: {provider}")
+
+            if page["next_cursor"] is None:
+                break
+            if input("Enter para ver más, 'q' para volver: ").strip().lower() == "q":
+                break
+            page = self.db.fetch_history(self.current_user, after_cursor=page["next_cursor"], page_size=self.page_size)
 
 
 # ------------------------------